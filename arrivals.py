@@ -0,0 +1,75 @@
+import heapq
+import math
+import random
+from typing import Callable, Iterable, Iterator, List, Optional, Union
+
+# Llegadas de pacientes en bucle abierto.
+# Los pacientes llegan según un proceso de Poisson, con tasa constante o
+# variable a lo largo del día, más ráfagas de víctimas en masa; la llegada no
+# depende de cuánto tarde el hospital en atender a los anteriores, así que la
+# cola crece cuando la carga ofrecida supera la capacidad. Los instantes están
+# en segundos simulados desde el inicio de la simulación.
+
+class DiurnalRate:
+    """Tasa de llegadas (pacientes/s) que oscila a lo largo del día con un máximo a peak_hour"""
+    def __init__(self, mean_rate: float, amplitude: float = 0.5, peak_hour: float = 18.0, period: float = 86400.0):
+        if not 0 <= amplitude <= 1:
+            raise ValueError(f"La amplitud debe estar entre 0 y 1: {amplitude}")
+        self.mean_rate = mean_rate
+        self.amplitude = amplitude
+        self.peak_hour = peak_hour
+        self.period = period # Duración de un "día" (se acorta para comprimir el ciclo)
+        self.max_rate = mean_rate * (1 + amplitude)
+
+    def __call__(self, t: float) -> float:
+        phase = t / self.period - self.peak_hour / 24
+        return self.mean_rate * (1 + self.amplitude * math.cos(2 * math.pi * phase))
+
+
+class MassCasualtyBurst:
+    """Ráfaga de `patients` llegadas repartidas al azar entre start y start + duration"""
+    def __init__(self, start: float, patients: int, duration: float = 60.0):
+        self.start = start
+        self.patients = patients
+        self.duration = duration
+
+    def arrival_times(self, rng: random.Random) -> List[float]:
+        return sorted(self.start + rng.uniform(0, self.duration) for _ in range(self.patients))
+
+
+class ArrivalProcess:
+    """Instantes de llegada: proceso de Poisson (tasa constante o función del tiempo) más ráfagas.
+
+    Con tasa variable las llegadas se generan por adelgazamiento (Lewis-Shedler):
+    candidatas de Poisson a la tasa máxima, aceptadas con probabilidad rate(t)/max_rate.
+    """
+    def __init__(self, rate: Union[float, Callable[[float], float]], max_rate: Optional[float] = None,
+                 bursts: Iterable[MassCasualtyBurst] = (), seed: Optional[int] = None):
+        self.rate = rate
+        if callable(rate):
+            max_rate = max_rate if max_rate is not None else getattr(rate, 'max_rate', None)
+            if max_rate is None:
+                raise ValueError("Con una tasa variable hay que indicar max_rate")
+        else:
+            max_rate = rate
+        if max_rate <= 0:
+            raise ValueError(f"La tasa de llegadas debe ser positiva: {max_rate}")
+        self.max_rate = max_rate
+        self.bursts = list(bursts)
+        self.seed = seed
+
+    def arrival_times(self, num_patients: Optional[int] = None) -> Iterator[float]:
+        """Genera los instantes de llegada en orden (sin fin si num_patients es None)"""
+        rng = random.Random(self.seed)
+        streams = [self._poisson(rng)] + [iter(burst.arrival_times(rng)) for burst in self.bursts]
+        for count, arrival in enumerate(heapq.merge(*streams)):
+            if num_patients is not None and count >= num_patients:
+                return
+            yield arrival
+
+    def _poisson(self, rng: random.Random) -> Iterator[float]:
+        t = 0.0
+        while True:
+            t += rng.expovariate(self.max_rate)
+            if not callable(self.rate) or rng.random() * self.max_rate <= self.rate(t):
+                yield t
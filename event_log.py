@@ -0,0 +1,183 @@
+import itertools
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional, TextIO, Tuple
+
+# Registro estructurado de eventos de la simulación.
+# Los hilos y el bucle de asyncio solo encolan una tupla con el evento; un hilo
+# aparte (QueueListener) construye el LogRecord, lo formatea y lo escribe, de
+# modo que ni la E/S ni el coste de crear el registro ocurren en el camino
+# crítico ni dentro de un lock. Los workers de diagnóstico
+# envían sus registros por una multiprocessing.Queue al mismo escritor. Cada
+# evento lleva un nombre y campos; el mensaje legible solo se formatea si el
+# registro llega a escribirse. Con el registro desactivado, log_event se reduce
+# a una comprobación de nivel.
+
+logger = logging.getLogger("hospital")
+logger.propagate = False
+logger.setLevel(logging.WARNING)
+
+_listeners = []
+_event_queue: Optional[queue.SimpleQueue] = None
+_worker_queue = None
+# Muestreo: se conserva uno de cada _sample_every eventos DEBUG/INFO de cada tipo; WARNING o más, siempre
+_sample_every = 1
+_sample_counters: Dict[str, itertools.count] = {}
+
+
+class EventRecord(logging.LogRecord):
+    """LogRecord de un evento: la plantilla se formatea con sus campos.
+
+    Así cualquier formateador (incluido logging.lastResort, que escribe los
+    WARNING/ERROR si nunca se llamó a configure_logging) muestra el mensaje completo.
+    """
+    def getMessage(self) -> str:
+        return self.msg.format(**self.fields) if self.fields else self.msg
+
+
+class EventFormatter(logging.Formatter):
+    """Formatea el mensaje del evento con sus campos (texto legible)"""
+    def format(self, record: logging.LogRecord) -> str:
+        return record.getMessage()
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Un objeto JSON por línea: instante, nivel, evento, origen, mensaje y campos"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "event": record.event,
+            "process": record.processName,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        entry.update(record.fields)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _EventQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El mensaje se formatea en el escritor: aquí solo se encola el registro
+        return record
+
+
+class _EventQueueListener(logging.handlers.QueueListener):
+    def prepare(self, item) -> logging.LogRecord:
+        # Los eventos del proceso principal llegan como tuplas; los de los workers, ya como registros
+        return _make_record(*item) if isinstance(item, tuple) else item
+
+
+def _make_record(created: float, level: int, event: str, message: str, fields: dict,
+                 thread: Optional[int] = None, thread_name: Optional[str] = None) -> EventRecord:
+    # Registro construido a mano: evita que logging inspeccione la pila buscando el llamador
+    record = EventRecord(logger.name, level, "", 0, message, None, None)
+    record.created = created
+    record.msecs = (created - int(created)) * 1000
+    if thread_name is not None:
+        record.thread, record.threadName = thread, thread_name
+    record.event = event
+    record.fields = fields
+    return record
+
+
+def log_event(level: int, event: str, message: str, **fields) -> None:
+    """Registra un evento; `message` es una plantilla str.format sobre los campos"""
+    if not logger.isEnabledFor(level):
+        return
+    if _sample_every > 1 and level < logging.WARNING:
+        counter = _sample_counters.get(event)
+        if counter is None:
+            counter = _sample_counters.setdefault(event, itertools.count())
+        if next(counter) % _sample_every: # next() sobre itertools.count es atómico con el GIL
+            return
+    if _event_queue is not None:
+        # Camino rápido: el escritor construye el registro a partir de la tupla
+        thread = threading.current_thread()
+        _event_queue.put((time.time(), level, event, message, fields, thread.ident, thread.name))
+        return
+    # Sin escritor propio (workers o registro sin configurar): pasa por los handlers del logger
+    logger.handle(_make_record(time.time(), level, event, message, fields))
+
+
+def configure_logging(level: int = logging.INFO, json_lines: bool = False, stream: Optional[TextIO] = None,
+                      path: Optional[str] = None, sample_rate: float = 1.0, enabled: bool = True) -> None:
+    """Configura el registro de eventos (sustituye cualquier configuración anterior).
+
+    path escribe en un fichero (JSON lines si json_lines); si no, en stream o stdout.
+    sample_rate < 1 conserva aproximadamente esa fracción de los eventos DEBUG/INFO.
+    enabled=False desactiva todo el registro, p. ej. para benchmarks.
+    """
+    global _event_queue, _worker_queue
+    shutdown_logging()
+    if not enabled:
+        logger.setLevel(logging.CRITICAL + 1)
+        return
+
+    handler = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonLinesFormatter() if json_lines else EventFormatter())
+    _set_sampling(max(1, round(1 / sample_rate)) if sample_rate > 0 else sys.maxsize)
+
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(_EventQueueHandler(log_queue))
+    logger.setLevel(level)
+    # Contexto sin fork: la cola puede pasarse a workers arrancados con forkserver o spawn
+    _worker_queue = multiprocessing.get_context('spawn').Queue()
+    for source in (log_queue, _worker_queue):
+        listener = _EventQueueListener(source, handler)
+        listener.start()
+        _listeners.append(listener)
+    _event_queue = log_queue
+
+
+def shutdown_logging() -> None:
+    """Escribe los eventos pendientes y detiene los hilos escritores"""
+    global _event_queue, _worker_queue
+    _event_queue = None
+    for listener in _listeners:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.flush()
+    _listeners.clear()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    _set_sampling(1)
+    logger.setLevel(logging.WARNING)
+    if _worker_queue is not None:
+        _worker_queue.close()
+        _worker_queue = None
+
+
+def worker_logging_config() -> Optional[Tuple[multiprocessing.Queue, int, int]]:
+    """Configuración a pasar a un proceso worker (cola, nivel, muestreo); None si el registro está apagado"""
+    if _worker_queue is None:
+        return None
+    return _worker_queue, logger.level, _sample_every
+
+
+def configure_worker_logging(config: Optional[Tuple[multiprocessing.Queue, int, int]]) -> None:
+    """En un proceso worker: envía los eventos al escritor del proceso principal"""
+    global _event_queue
+    for handler in list(logger.handlers): # Heredados con fork: su escritor no existe en este proceso
+        logger.removeHandler(handler)
+    _listeners.clear()
+    _event_queue = None
+    if config is None:
+        logger.setLevel(logging.CRITICAL + 1)
+        return
+    worker_queue, level, sample_every = config
+    _set_sampling(sample_every)
+    logger.addHandler(_EventQueueHandler(worker_queue))
+    logger.setLevel(level)
+
+
+def _set_sampling(every: int) -> None:
+    global _sample_every
+    _sample_every = every
+    _sample_counters.clear()
@@ -0,0 +1,302 @@
+import heapq
+import itertools
+import random
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from arrivals import ArrivalProcess
+
+from hospital_system import (CONDITIONS, SYMPTOMS, TREATMENTS, Patient, PatientStatus, Priority, default_diagnosis_workers,
+                             get_clock, set_clock)
+from simulation_clock import ManualClock
+
+# Simulación de eventos discretos (DES) del departamento de emergencias.
+# Reproduce el mismo flujo que hospital_simulation (registro → diagnóstico →
+# asignación → alta) con las mismas distribuciones de tiempos, pero sobre un
+# reloj virtual: el tiempo salta de evento en evento sin esperas reales, lo que
+# permite simular cientos de miles de pacientes en segundos con un solo núcleo.
+# Doctores y camas se modelan como recursos FIFO sin especialidades ni salas,
+# pedidos de uno en uno (doctor y luego cama): equivale a hospital_simulation
+# solo con la configuración de EQUIVALENT_RESOURCE_OPTIONS, no con la de por
+# defecto (prioridad, asignación atómica y emparejamiento según diagnóstico).
+
+# Opciones de HospitalResources con las que la simulación real sigue el mismo modelo que la DES
+EQUIVALENT_RESOURCE_OPTIONS = {
+    'allocation_mode': 'sequential',
+    'resource_matching': False,
+    'prioritize_resources': False,
+}
+
+class EventScheduler:
+    """Cola de eventos (heap) ordenada por tiempo virtual; el reloj solo avanza al procesar un evento"""
+    def __init__(self, clock: Optional[ManualClock] = None):
+        self.clock = clock or ManualClock()
+        self._heap = []
+        self._sequence = itertools.count() # Desempate estable para eventos simultáneos
+        self.processed_events = 0
+
+    def schedule(self, delay: float, callback: Callable, *args) -> None:
+        heapq.heappush(self._heap, (self.clock.now() + delay, next(self._sequence), callback, args))
+
+    def run(self, until: Optional[float] = None) -> None:
+        heap = self._heap
+        while heap:
+            event_time, _, callback, args = heap[0]
+            if until is not None and event_time > until:
+                break
+            heapq.heappop(heap)
+            self.clock.advance_to(event_time)
+            callback(*args)
+            self.processed_events += 1
+
+
+class VirtualResource:
+    """Equivalente virtual de un semáforo: concede permisos en orden FIFO"""
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.available = capacity
+        self._waiters = deque()
+
+    def acquire(self, callback: Callable, *args) -> None:
+        if self.available > 0:
+            self.available -= 1
+            callback(*args)
+        else:
+            self._waiters.append((callback, args))
+
+    def release(self) -> None:
+        if self._waiters:
+            # El permiso pasa directamente al siguiente en espera, en el mismo instante
+            callback, args = self._waiters.popleft()
+            callback(*args)
+        else:
+            self.available += 1
+
+
+class DiscreteEventHospital:
+    """Modelo de eventos discretos equivalente a hospital_simulation con EQUIVALENT_RESOURCE_OPTIONS"""
+    def __init__(self, num_doctors: int = 5, num_beds: int = 10,
+                 num_registration_workers: int = 5,
+                 num_diagnosis_workers: Optional[int] = None,
+                 num_discharge_workers: int = 4,
+                 release_policy: str = 'stage',
+                 max_patients_in_system: Optional[int] = None,
+                 seed: Optional[int] = None):
+        if num_diagnosis_workers is None:
+            num_diagnosis_workers = default_diagnosis_workers()
+
+        self.scheduler = EventScheduler()
+        self.clock = self.scheduler.clock
+        self.random = random.Random(seed)
+
+        # Mismos recursos que la simulación real con EQUIVALENT_RESOURCE_OPTIONS (FIFO, sin especialidades ni salas)
+        self.registration_workers = VirtualResource(num_registration_workers) # ThreadPoolExecutor
+        self.diagnosis_workers = VirtualResource(num_diagnosis_workers)       # Procesos de diagnóstico
+        self.doctors = VirtualResource(num_doctors)                           # Doctores (allocator)
+        self.beds = VirtualResource(num_beds)                                 # Camas (allocator)
+        self.discharge_workers = VirtualResource(num_discharge_workers)       # DischargeWorkers
+
+        self.num_doctors = num_doctors
+        self.release_policy = release_policy # Como en HospitalResources: 'stage' o 'discharge'
+        self.num_beds = num_beds
+        # Como en HospitalResources: con límite, cada alta deja entrar al siguiente paciente de la fuente
+        self.max_patients_in_system = max_patients_in_system
+        self._patient_ids: Optional[Iterator[int]] = None
+        self.admission: Optional[VirtualResource] = None
+
+        # Contadores para estadísticas
+        self.total_patients = 0
+        self.processed_patients = 0
+        self.avg_wait_time = 0.0
+        self.last_discharge_time = 0.0
+
+    # 0. Llegada
+    def _arrive(self, patient_id: int, arrival_time: Optional[float] = None) -> None:
+        patient = Patient(
+            priority=Priority.MEDIUM,
+            id=patient_id,
+            name=f"Paciente_{patient_id}",
+            symptoms=[self.random.choice(SYMPTOMS)],
+            registration_time=self.clock.now() if arrival_time is None else arrival_time
+        )
+        self.admit(patient)
+
+    def _admit_next(self) -> None:
+        patient_id = next(self._patient_ids, None)
+        if patient_id is not None:
+            self._arrive(patient_id)
+
+    def _schedule_arrival(self, arrival_times: Iterator[float], patient_ids: Iterator[int]) -> None:
+        arrival_time = next(arrival_times, None)
+        if arrival_time is not None:
+            self.scheduler.schedule(arrival_time - self.clock.now(), self._next_arrival, arrival_times, patient_ids)
+
+    def _next_arrival(self, arrival_times: Iterator[float], patient_ids: Iterator[int]) -> None:
+        if self.admission:
+            # Con el hospital lleno solo espera (id, instante de llegada): el Patient se crea al entrar
+            self.admission.acquire(self._arrive, next(patient_ids), self.clock.now())
+        else:
+            self._arrive(next(patient_ids))
+        self._schedule_arrival(arrival_times, patient_ids)
+
+    # 1. Registro
+    def admit(self, patient: Patient) -> None:
+        self.registration_workers.acquire(self._start_registration, patient)
+
+    def _start_registration(self, patient: Patient) -> None:
+        processing_time = self.random.uniform(0.5, 1.5)
+        self.scheduler.schedule(processing_time, self._finish_registration, patient)
+
+    def _finish_registration(self, patient: Patient) -> None:
+        self.registration_workers.release()
+        self.total_patients += 1
+        patient.priority = self.random.choice([p for p in Priority])
+        patient.status = PatientStatus.REGISTERED
+        self.diagnosis_workers.acquire(self._start_diagnosis, patient)
+
+    # 2. Diagnóstico
+    def _start_diagnosis(self, patient: Patient) -> None:
+        patient.status = PatientStatus.WAITING_DIAGNOSIS
+        processing_time = self.random.uniform(1, 3)
+        self.scheduler.schedule(processing_time, self._finish_diagnosis, patient, processing_time)
+
+    def _finish_diagnosis(self, patient: Patient, processing_time: float) -> None:
+        self.diagnosis_workers.release()
+        patient.diagnosis = {
+            'condition': self.random.choice(CONDITIONS),
+            'severity': self.random.randint(1, 10),
+            'recommended_treatment': self.random.choice(TREATMENTS),
+            'processing_time': processing_time
+        }
+        patient.status = PatientStatus.DIAGNOSED
+        self._start_allocation(patient)
+
+    # 3. Asignación de recursos y tratamiento
+    def _start_allocation(self, patient: Patient) -> None:
+        patient.status = PatientStatus.WAITING_RESOURCE
+        # Consulta simulada al sistema externo antes de pedir recursos
+        self.scheduler.schedule(self.random.uniform(0.2, 0.8), self.doctors.acquire, self._doctor_acquired, patient)
+
+    def _doctor_acquired(self, patient: Patient) -> None:
+        # Como allocate_resources en modo 'sequential': el doctor se retiene mientras se espera cama
+        self.beds.acquire(self._bed_acquired, patient)
+
+    def _bed_acquired(self, patient: Patient) -> None:
+        patient.assigned_resources = {'assignment_time': self.clock.now()}
+        patient.status = PatientStatus.IN_TREATMENT
+        treatment_time = self.random.uniform(2, 5)
+        self.scheduler.schedule(treatment_time, self._finish_treatment, patient)
+
+    def _finish_treatment(self, patient: Patient) -> None:
+        if self.release_policy == 'stage':
+            self.doctors.release() # El doctor queda libre al terminar el tratamiento
+        patient.status = PatientStatus.READY_FOR_DISCHARGE
+        self.discharge_workers.acquire(self._start_discharge, patient)
+
+    # 4. Alta
+    def _start_discharge(self, patient: Patient) -> None:
+        self.scheduler.schedule(self.random.uniform(0.5, 1), self._finish_discharge, patient)
+
+    def _finish_discharge(self, patient: Patient) -> None:
+        if self.release_policy == 'discharge':
+            self.doctors.release()
+        self.beds.release()
+        self.discharge_workers.release()
+
+        patient.status = PatientStatus.DISCHARGED
+        total_time_in_system = self.clock.now() - patient.registration_time
+
+        self.processed_patients += 1
+        self.avg_wait_time = (
+            (self.avg_wait_time * (self.processed_patients - 1)) + total_time_in_system
+        ) / self.processed_patients
+        self.last_discharge_time = self.clock.now()
+        if self.admission:
+            self.admission.release() # Entra el siguiente que espera plaza, con su instante de llegada
+        elif self._patient_ids is not None:
+            self._admit_next()
+
+    def run(self, num_patients: int, arrivals: Optional[ArrivalProcess] = None) -> Dict[str, Any]:
+        """Simula num_patients pacientes llegando a la vez (o según arrivals), como hospital_simulation"""
+        # El reloj virtual sustituye al global mientras dura la simulación (marcas de los Patient)
+        previous_clock = get_clock()
+        set_clock(self.clock)
+        try:
+            return self._run(num_patients, arrivals)
+        finally:
+            set_clock(previous_clock)
+
+    def _run(self, num_patients: int, arrivals: Optional[ArrivalProcess]) -> Dict[str, Any]:
+        if arrivals is None and self.max_patients_in_system:
+            # Pacientes creados bajo demanda: memoria acotada por el límite, no por num_patients
+            self._patient_ids = iter(range(1, num_patients + 1))
+            for _ in range(self.max_patients_in_system):
+                self._admit_next()
+        elif arrivals is None:
+            for i in range(1, num_patients + 1):
+                self._arrive(i)
+        else:
+            if self.max_patients_in_system:
+                # Como register_patients: las llegadas siguen su curso y esperan plaza en orden
+                self.admission = VirtualResource(self.max_patients_in_system)
+            # Cada llegada programa la siguiente: el heap nunca guarda más de una llegada pendiente
+            self._schedule_arrival(arrivals.arrival_times(num_patients), itertools.count(1))
+
+        self.scheduler.run()
+
+        total_time = self.last_discharge_time
+        return {
+            "total_time": total_time,
+            "avg_wait_time": self.avg_wait_time,
+            "patients": num_patients,
+            "doctors": self.num_doctors,
+            "beds": self.num_beds,
+            "throughput": num_patients / total_time if total_time > 0 else 0.0,
+            "events": self.scheduler.processed_events
+        }
+
+
+def run_discrete_event_simulation(num_patients: int, num_doctors: int = 5, num_beds: int = 10,
+                                  num_diagnosis_workers: Optional[int] = None,
+                                  num_discharge_workers: int = 4,
+                                  release_policy: str = 'stage',
+                                  seed: Optional[int] = None,
+                                  max_patients_in_system: Optional[int] = None,
+                                  arrivals: Optional[ArrivalProcess] = None) -> Dict[str, Any]:
+    """Ejecuta la simulación de eventos discretos y devuelve las métricas en tiempo virtual"""
+    hospital = DiscreteEventHospital(
+        num_doctors=num_doctors,
+        num_beds=num_beds,
+        num_diagnosis_workers=num_diagnosis_workers,
+        num_discharge_workers=num_discharge_workers,
+        release_policy=release_policy,
+        max_patients_in_system=max_patients_in_system,
+        seed=seed
+    )
+    return hospital.run(num_patients, arrivals)
+
+
+# Punto de entrada
+if __name__ == "__main__":
+    NUM_PATIENTS_TO_SIMULATE = 100_000
+    NUM_DOCTORS = 50
+    NUM_BEDS = 100
+    NUM_DIAGNOSIS_WORKERS = 40
+
+    print(f"Simulando {NUM_PATIENTS_TO_SIMULATE} pacientes con reloj virtual...")
+    start_time = time.perf_counter()
+    result = run_discrete_event_simulation(
+        NUM_PATIENTS_TO_SIMULATE, NUM_DOCTORS, NUM_BEDS,
+        num_diagnosis_workers=NUM_DIAGNOSIS_WORKERS, seed=42
+    )
+    elapsed = time.perf_counter() - start_time
+
+    print("\n--- Estadísticas Finales (tiempo virtual) ---")
+    print(f"Pacientes dados de alta: {result['patients']}")
+    print(f"Tiempo simulado: {result['total_time']:.2f}s ({result['total_time'] / 3600:.2f}h)")
+    print(f"Tiempo promedio en sistema: {result['avg_wait_time']:.2f}s")
+    print(f"Throughput: {result['throughput']:.2f} pacientes/s simulados")
+    print(f"Eventos procesados: {result['events']}")
+    print("--------------------------------")
+    print(f"Simulación completada en {elapsed:.2f} segundos reales.")
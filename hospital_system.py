@@ -1,13 +1,47 @@
 import asyncio
+import itertools
+import math
 import time
 import random
 import multiprocessing
 import threading
+import logging
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 import queue
+import struct
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Tuple, Iterable, Iterator, AsyncIterable, AsyncIterator, Union
+
+from shared_ring import SharedMemoryQueue
+from streaming_stats import ConcurrencyTimeline, ShardedStats, StageStats
+from simulation_clock import SimulationClock
+from arrivals import ArrivalProcess
+from event_log import log_event, worker_logging_config, configure_worker_logging, configure_logging, shutdown_logging
+
+# Reloj de la simulación: todas las marcas de tiempo y esperas pasan por él.
+# Con escala 100 cada espera simulada dura 100 veces menos en tiempo real,
+# manteniendo las latencias relativas entre etapas
+clock = SimulationClock()
+
+def get_clock() -> SimulationClock:
+    return clock
+
+def set_clock(new_clock: SimulationClock) -> None:
+    """Sustituye el reloj global (un SimulationClock; ManualClock solo sirve para hospital_des)"""
+    global clock
+    clock = new_clock
+
+def set_time_scale(scale: float) -> None:
+    """Atajo: reloj monotónico real comprimido `scale` veces"""
+    set_clock(SimulationClock(scale))
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Percentil q (0-100) de una lista ya ordenada, por el método del rango más cercano"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
 
 # Definición de estados de los pacientes
 class PatientStatus(Enum):
@@ -27,6 +61,16 @@ class Priority(Enum):
     HIGH = 1
     CRITICAL = 0
 
+PRIORITIES = list(Priority) # Para elegir la gravedad al registrar sin recrear la lista
+
+# Catálogos compartidos; su posición es el código usado en el formato compacto de IPC
+SYMPTOMS = ["Fiebre", "Dolor", "Tos", "Mareo", "Fractura"]
+CONDITIONS = ['Gripe', 'Fractura', 'Apendicitis', 'COVID-19', 'Migraña']
+TREATMENTS = ['Medicamentos', 'Cirugía', 'Observación', 'Terapia']
+# Atributos de los recursos del hospital (especialidad del doctor, sala de la cama)
+SPECIALITIES = ['General', 'Urgencias', 'Cirugía']
+WARDS = ['General', 'Intensivos', 'Recuperación']
+
 @dataclass(order=True)
 class Patient:
     priority: Priority = field(compare=True)
@@ -34,139 +78,1090 @@ class Patient:
     name: str = field(compare=False)
     symptoms: List[str] = field(compare=False, default_factory=list)
     status: PatientStatus = field(compare=False, default=PatientStatus.WAITING_REGISTRATION)
-    registration_time: float = field(compare=False, default_factory=time.time)
+    registration_time: float = field(compare=False, default_factory=lambda: clock.now())
     diagnosis: Dict[str, Any] = field(compare=False, default_factory=dict)
     assigned_resources: Dict[str, Any] = field(compare=False, default_factory=dict)
+    # Instante (clock.now()) de cada transición, indexado por PatientStatus.value;
+    # la posición de WAITING_REGISTRATION guarda la llegada
+    status_times: List[Optional[float]] = field(
+        compare=False, repr=False,
+        default_factory=lambda: [clock.now()] + [None] * (len(PatientStatus) - 1)
+    )
+    
+    def set_status(self, status: PatientStatus) -> None:
+        """Cambia el estado y anota el instante de la transición"""
+        self.status = status
+        self.status_times[status.value] = clock.now()
     
     def __str__(self):
         return f"Paciente {self.id} ({self.name}): {self.status.name}, Prioridad: {self.priority.name}"
 
+# Formato compacto para las colas de diagnóstico: en lugar de serializar el Patient
+# completo solo viaja lo que el diagnóstico necesita. Un mensaje es la concatenación
+# de uno o más registros de tamaño fijo (un lote son varios registros seguidos).
+DIAGNOSIS_REQUEST = struct.Struct('<IBBd')    # id, prioridad, máscara de síntomas, encolado
+DIAGNOSIS_RESULT = struct.Struct('<IBBBddd')  # id, condición, severidad, tratamiento, tiempo de proceso, espera, completado
+WARMUP_PRIORITY = 0xFF                       # Petición de calentamiento: recorre la IPC sin simular carga
+
+def encode_diagnosis_request(patient: Patient) -> bytes:
+    symptom_mask = 0
+    for symptom in patient.symptoms:
+        if symptom in SYMPTOMS:
+            symptom_mask |= 1 << SYMPTOMS.index(symptom)
+    return DIAGNOSIS_REQUEST.pack(patient.id, patient.priority.value, symptom_mask, clock.now())
+
+def merge_diagnosis_results(message: bytes, pending: Dict[int, Patient]) -> List[Patient]:
+    """Incorpora los resultados recibidos a los Patient canónicos que esperan diagnóstico"""
+    patients = []
+    for patient_id, condition, severity, treatment, processing_time, queue_wait, completed_at in DIAGNOSIS_RESULT.iter_unpack(message):
+        patient = pending.pop(patient_id)
+        patient.diagnosis = {
+            'condition': CONDITIONS[condition],
+            'severity': severity,
+            'recommended_treatment': TREATMENTS[treatment],
+            'processing_time': processing_time,
+            'queue_wait': queue_wait, # Segundos simulados en cola antes de que un worker lo atendiera
+            'completed_at': completed_at
+        }
+        patient.set_status(PatientStatus.DIAGNOSED)
+        patients.append(patient)
+    return patients
+
+# Transportes disponibles para las colas de diagnóstico
+DIAGNOSIS_TRANSPORTS = ('queue', 'shm')
+
+# Los workers de diagnóstico no se crean con fork: el autoescalado los arranca con la simulación en
+# marcha (hilos lector de resultados, flusher de lotes y escritor del registro), y un fork mientras otro
+# hilo tiene un lock tomado (handler de logging, alimentador de una cola) puede bloquear al hijo.
+# Sus colas, semáforos y eventos se crean en el mismo contexto para poder pasárselos.
+WORKER_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+worker_context = multiprocessing.get_context(WORKER_START_METHOD)
+if WORKER_START_METHOD == 'forkserver':
+    worker_context.set_forkserver_preload([__name__]) # Cada worker nuevo parte con este módulo ya importado
+
+def create_diagnosis_queue(transport: str = 'queue', record: struct.Struct = DIAGNOSIS_REQUEST,
+                           max_records: int = 1):
+    """Crea una cola de diagnóstico: multiprocessing.Queue o buffer circular en memoria compartida"""
+    if transport == 'queue':
+        return worker_context.Queue()
+    if transport == 'shm':
+        # Cada ranura debe poder alojar un lote completo de registros
+        return SharedMemoryQueue(slot_size=record.size * max_records, ctx=worker_context)
+    raise ValueError(f"Transporte de diagnóstico desconocido: {transport} (opciones: {DIAGNOSIS_TRANSPORTS})")
+
+class PriorityDiagnosisQueue:
+    """Cola de peticiones de diagnóstico entre procesos con un carril FIFO por prioridad.
+
+    Un semáforo compartido cuenta los mensajes de todos los carriles: los workers
+    se bloquean en él sin sondeos. Al despertar, cada worker reclama un mensaje
+    del carril más prioritario con trabajo según unos contadores por carril en
+    memoria compartida, y solo entonces lo lee con una espera bloqueante: el
+    mensaje reclamado es suyo aunque otro worker esté leyendo el mismo carril o
+    siga en tránsito, de modo que nunca se salta un carril CRITICAL con trabajo.
+    Los centinelas van a un carril de control que solo se atiende con los
+    carriles de pacientes vacíos, así el apagado sigue vaciando lo pendiente.
+    Con priority_lanes=False todos los pacientes comparten un carril (FIFO puro).
+    Los contadores también dan la profundidad, porque multiprocessing.Queue.qsize
+    no está implementado en macOS.
+    """
+    def __init__(self, transport: str = 'queue', max_records: int = 1, priority_lanes: bool = True):
+        self.priority_lanes = priority_lanes
+        num_lanes = len(Priority) if priority_lanes else 1
+        self.lanes = [create_diagnosis_queue(transport, DIAGNOSIS_REQUEST, max_records) for _ in range(num_lanes + 1)]
+        self._available = worker_context.Semaphore(0)
+        self._counts = worker_context.Array('i', len(self.lanes)) # Mensajes sin reclamar por carril
+
+    def put(self, message: Optional[bytes], priority: int = Priority.LOW.value) -> None:
+        """Encola un mensaje en el carril de su prioridad (None va al carril de control)"""
+        if message is None:
+            lane = len(self.lanes) - 1
+        else:
+            lane = priority if self.priority_lanes else 0
+        self.lanes[lane].put(message)
+        with self._counts.get_lock():
+            self._counts[lane] += 1
+        self._available.release()
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Optional[bytes]:
+        if not self._available.acquire(block, timeout):
+            raise queue.Empty
+        # El semáforo nunca supera la suma de los contadores: siempre hay un carril que reclamar
+        with self._counts.get_lock():
+            lane = next(i for i, count in enumerate(self._counts) if count) # De CRITICAL (0) al carril de control
+            self._counts[lane] -= 1
+        return self.lanes[lane].get()
+
+    def get_nowait(self) -> Optional[bytes]:
+        return self.get(block=False)
+
+    def qsize(self) -> int:
+        """Mensajes de pacientes pendientes (sin contar centinelas)"""
+        return sum(self._counts[:-1])
+
+    def close(self) -> None:
+        for lane in self.lanes:
+            lane.close()
+
+class DiagnosisBatcher:
+    """Agrupa los pacientes registrados en lotes antes de enviarlos a los workers de diagnóstico.
+
+    Un lote se envía al alcanzar batch_size pacientes o cuando el paciente más
+    antiguo lleva max_linger segundos (reales) esperando, lo que ocurra antes.
+    Los registros compactos del lote viajan concatenados en un único mensaje.
+    Cada prioridad forma sus propios lotes para respetar los carriles de la cola.
+    """
+    def __init__(self, diagnosis_queue: PriorityDiagnosisQueue, batch_size: int = 16, max_linger: float = 0.01):
+        self.diagnosis_queue = diagnosis_queue
+        self.batch_size = batch_size
+        self.max_linger = max_linger
+        self._pending: Dict[int, List[bytes]] = {}  # Solo prioridades con lote abierto
+        self._oldest_time: Dict[int, float] = {}
+        self._closed = False
+        self._condition = threading.Condition()
+        self._flusher = threading.Thread(target=self._flush_expired, name="DiagBatchFlusher", daemon=True)
+        self._flusher.start()
+
+    def submit(self, record: bytes, priority: int) -> None:
+        with self._condition:
+            if priority not in self._pending:
+                self._pending[priority] = []
+                self._oldest_time[priority] = time.monotonic()
+                self._condition.notify() # Despertar al flusher para que vigile el nuevo lote
+            self._pending[priority].append(record)
+            batch = self._take_batch(priority) if len(self._pending[priority]) >= self.batch_size else None
+        if batch:
+            self._send(priority, batch) # El put (pickle + pipe) se hace fuera del lock
+
+    def close(self) -> None:
+        """Envía los lotes parciales pendientes y detiene el flusher"""
+        with self._condition:
+            self._closed = True
+            batches = [(priority, self._take_batch(priority)) for priority in list(self._pending)]
+            self._condition.notify()
+        for priority, batch in batches:
+            self._send(priority, batch)
+        self._flusher.join()
+
+    def _take_batch(self, priority: int) -> List[bytes]:
+        del self._oldest_time[priority]
+        return self._pending.pop(priority)
+
+    def _send(self, priority: int, batch: List[bytes]) -> None:
+        self.diagnosis_queue.put(b''.join(batch), priority)
+
+    def _flush_expired(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                now = time.monotonic()
+                expired = [priority for priority, oldest in self._oldest_time.items() if oldest + self.max_linger <= now]
+                if not expired:
+                    self._condition.wait(min(self._oldest_time.values()) + self.max_linger - now)
+                    continue
+                batches = [(priority, self._take_batch(priority)) for priority in expired]
+            for priority, batch in batches:
+                self._send(priority, batch)
+
+class PriorityResourceAllocator:
+    """Asigna recursos de varios tipos por prioridad y de forma atómica (todo o nada).
+
+    Cada petición indica las unidades que necesita de cada tipo (p. ej.
+    {'doctor:General': 1, 'bed:General': 1}) y solo se concede cuando todas están
+    libres, sin retener unas mientras espera las otras. Una petición puede traer
+    alternativas en orden de preferencia: se concede la primera que esté libre.
+    A diferencia de asyncio.Semaphore (FIFO), las peticiones se atienden por
+    (prioridad, llegada); con aging (segundos simulados) quien espera gana un nivel
+    por cada `aging` segundos. Una petición que no puede atenderse reserva los
+    tipos de su alternativa preferida: solo se le adelantan peticiones de otros
+    tipos, así un lote doctor+cama no sufre inanición frente a peticiones sueltas.
+    Con prioritized=False el orden es FIFO. Si recibe stats, cuenta por tipo de
+    petición las concedidas ('granted:'), las que tuvieron que esperar ('queued:')
+    y las canceladas mientras esperaban ('cancelled:').
+    """
+    def __init__(self, capacities: Dict[str, int], aging: Optional[float] = None, prioritized: bool = True,
+                 stats: Optional[ShardedStats] = None):
+        self.capacities = dict(capacities)
+        self.stats = stats
+        self.available = dict(capacities)
+        self.aging = aging
+        self.prioritized = prioritized
+        # Un carril FIFO por (alternativas pedidas, prioridad): dentro de un carril solo importa la cabeza
+        self._lanes: Dict[tuple, deque] = {}
+        self._waiting = 0
+        # Espera (segundos simulados) por tipo de petición ('doctor', 'bed', 'bed+doctor'); una etapa por prioridad
+        self.wait_times: Dict[str, StageStats] = {}
+        # Unidades·segundo simulados ocupadas por tipo, para calcular la utilización
+        self._busy_time = {kind: 0.0 for kind in capacities}
+        self._last_change = clock.now()
+
+    async def acquire(self, candidates: List[Dict[str, int]], priority: Priority = Priority.LOW,
+                      label: Optional[str] = None, since: Optional[float] = None) -> Dict[str, int]:
+        """Espera hasta conceder una de las alternativas y devuelve la concedida.
+
+        since es el instante desde el que se espera (por defecto, ahora): una petición
+        repetida con más alternativas conserva su antigüedad.
+        """
+        start_time = clock.now() if since is None else since
+        label = label or '+'.join(sorted(candidates[0]))
+        granted = None
+        if not self._waiting:
+            granted = next((demand for demand in candidates if self._can_grant(demand)), None)
+        if granted is not None:
+            self._take(granted)
+        else:
+            entry = (start_time, candidates, asyncio.get_running_loop().create_future())
+            signature = tuple(tuple(sorted(demand)) for demand in candidates)
+            lane = self._lanes.setdefault((signature, priority), deque())
+            lane.append(entry)
+            self._waiting += 1
+            self._count('queued', label)
+            self._grant_waiters() # Puede concederse ya si solo esperan peticiones de otros tipos
+            try:
+                granted = await entry[2]
+            except asyncio.CancelledError:
+                if entry[2].done() and not entry[2].cancelled():
+                    self.release(entry[2].result()) # Los recursos llegaron a la vez que la cancelación: cederlos
+                else:
+                    try:
+                        lane.remove(entry)
+                        self._waiting -= 1
+                    except ValueError:
+                        pass # Ya descartada por _grant_waiters
+                    if not lane and self._lanes.get((signature, priority)) is lane:
+                        del self._lanes[(signature, priority)]
+                    # Si era la cabeza que reservaba sus tipos, los que esperaban detrás pueden pasar ya
+                    self._grant_waiters()
+                    self._count('cancelled', label)
+                raise
+        self._count('granted', label)
+        waits = self.wait_times.get(label)
+        if waits is None:
+            waits = self.wait_times[label] = StageStats()
+        waits.record(priority.name, clock.elapsed(start_time))
+        return granted
+
+    def _count(self, outcome: str, label: str) -> None:
+        if self.stats is not None:
+            self.stats.increment(f'{outcome}:{label}')
+
+    def release(self, demand: Dict[str, int]) -> None:
+        self._account()
+        for kind, units in demand.items():
+            self.available[kind] += units
+        self._grant_waiters()
+
+    def busy_time(self, prefix: str) -> float:
+        """Unidades·segundo simulados ocupadas por los tipos que empiezan por prefix"""
+        self._account()
+        return sum(busy for kind, busy in self._busy_time.items() if kind.startswith(prefix))
+
+    def _can_grant(self, demand: Dict[str, int]) -> bool:
+        return all(self.available[kind] >= units for kind, units in demand.items())
+
+    def _take(self, demand: Dict[str, int]) -> None:
+        self._account()
+        for kind, units in demand.items():
+            self.available[kind] -= units
+
+    def _account(self) -> None:
+        now = clock.now()
+        elapsed = now - self._last_change
+        for kind, capacity in self.capacities.items():
+            self._busy_time[kind] += (capacity - self.available[kind]) * elapsed
+        self._last_change = now
+
+    def _grant_waiters(self) -> None:
+        now = clock.now()
+        reserved = set()
+        blocked = set()
+        while self._waiting:
+            best = None
+            for key, lane in self._lanes.items():
+                while lane and lane[0][2].done(): # Saltar esperas canceladas
+                    lane.popleft()
+                    self._waiting -= 1
+                if not lane or key in blocked or all(reserved.intersection(kinds) for kinds in key[0]):
+                    continue
+                rank = self._rank(key[1], lane[0][0], now)
+                if best is None or rank < best[0]:
+                    best = (rank, key, lane)
+            if best is None:
+                return
+            _, key, lane = best
+            _, candidates, future = lane[0]
+            granted = next((demand for demand in candidates
+                            if not reserved.intersection(demand) and self._can_grant(demand)), None)
+            if granted is not None:
+                lane.popleft()
+                self._waiting -= 1
+                self._take(granted)
+                future.set_result(granted) # Se entrega sin pasar por la vía rápida: nadie puede colarse
+            else:
+                reserved.update(candidates[0]) # Nadie de menor rango puede quitarle su alternativa preferida
+                blocked.add(key)
+
+    def _rank(self, priority: Priority, arrival_time: float, now: float) -> tuple:
+        if not self.prioritized:
+            return (0, arrival_time)
+        effective = priority.value
+        if self.aging:
+            effective -= (now - arrival_time) / self.aging
+        return (effective, arrival_time)
+
+def apportion(size: int, weights: Dict[str, float]) -> Dict[str, int]:
+    """Reparte size unidades en proporción a los pesos (restos mayores), al menos una por valor si alcanzan"""
+    total = sum(weights.values())
+    quotas = {value: size * weight / total for value, weight in weights.items()}
+    minimum = 1 if size >= len(weights) else 0
+    counts = {value: max(minimum, int(quota)) for value, quota in quotas.items()}
+    while sum(counts.values()) < size:
+        counts[max(quotas, key=lambda value: quotas[value] - counts[value])] += 1
+    while sum(counts.values()) > size:
+        counts[max((value for value in counts if counts[value] > minimum),
+                   key=lambda value: counts[value] - quotas[value])] -= 1
+    return counts
+
+class ResourcePool:
+    """Recursos con identidad (doctores o camas) y una lista libre por atributo.
+
+    Cada recurso es un dict con 'id' y su atributo ('speciality' o 'ward').
+    Tomar y devolver un recurso es O(1); el pool no espera: el
+    PriorityResourceAllocator garantiza antes que hay unidades libres.
+    """
+    def __init__(self, kind: str, attribute: str, values: List[str], size: int, first_id: int,
+                 weights: Optional[Dict[str, float]] = None):
+        self.kind = kind
+        self.attribute = attribute
+        # Los atributos se reparten según weights (p. ej. la demanda de cada uno), intercalados;
+        # sin weights, a partes iguales
+        counts = apportion(size, weights or dict.fromkeys(values, 1.0))
+        order = [value for i in range(size) for value in values if counts[value] > i]
+        self.items = [{'id': first_id + i, attribute: value} for i, value in enumerate(order)]
+        self._free: Dict[str, List[dict]] = {value: [] for value in values}
+        for item in reversed(self.items):
+            self._free[item[attribute]].append(item)
+        self.capacity = {value: len(free) for value, free in self._free.items()}
+        self._acquired_at: Dict[int, float] = {}
+        self.busy_time = {item['id']: 0.0 for item in self.items} # Segundos simulados ocupado, por recurso
+
+    def key(self, value: str) -> str:
+        """Tipo de recurso para el allocator, p. ej. 'bed:Intensivos'"""
+        return f"{self.kind}:{value}"
+
+    def acquire(self, value: Optional[str] = None) -> dict:
+        """Toma un recurso libre, del atributo indicado o de cualquiera"""
+        if value is None:
+            value = next((v for v, free in self._free.items() if free), None)
+        free = self._free.get(value)
+        if not free:
+            raise LookupError(f"No hay {self.kind} libre con {self.attribute}={value}")
+        item = free.pop()
+        self._acquired_at[item['id']] = clock.now()
+        return item
+
+    def release(self, item: dict) -> None:
+        acquired_at = self._acquired_at.pop(item['id'], None)
+        if acquired_at is None:
+            raise ValueError(f"{self.kind} {item['id']} no estaba asignado")
+        self.busy_time[item['id']] += clock.elapsed(acquired_at)
+        self._free[item[self.attribute]].append(item)
+
+# Modos de asignación de doctor y cama en allocate_resources
+ALLOCATION_MODES = ('bundle', 'sequential')
+# Cuándo se libera el doctor: al terminar el tratamiento ('stage') o junto con la cama en el alta ('discharge')
+RELEASE_POLICIES = ('stage', 'discharge')
+# Registro en hilos de un ThreadPoolExecutor ('threads') o como corrutinas del bucle principal ('asyncio')
+REGISTRATION_MODES = ('threads', 'asyncio')
+
+# Emparejamiento según diagnóstico: alternativas aceptables para cada especialidad y sala.
+# Cirujanos y camas de Intensivos no se ceden a quien no los necesita (salvo pasado matching_wait_limit)
+SPECIALITY_FALLBACKS = {'Cirugía': [], 'Urgencias': ['General'], 'General': ['Urgencias']}
+WARD_FALLBACKS = {'Intensivos': [], 'Recuperación': ['General'], 'General': ['Recuperación']}
+SURGICAL_CONDITIONS = {'Apendicitis'}
+INTENSIVE_CARE_SEVERITY = 8
+
+def preferred_resources(patient: Patient) -> Tuple[str, str]:
+    """Especialidad del doctor y sala de la cama adecuadas al diagnóstico del paciente"""
+    diagnosis = patient.diagnosis or {}
+    treatment = diagnosis.get('recommended_treatment')
+    severity = diagnosis.get('severity', 0)
+    if treatment == 'Cirugía' or diagnosis.get('condition') in SURGICAL_CONDITIONS:
+        speciality = 'Cirugía'
+    elif patient.priority == Priority.CRITICAL or severity >= INTENSIVE_CARE_SEVERITY:
+        speciality = 'Urgencias'
+    else:
+        speciality = 'General'
+    if severity >= INTENSIVE_CARE_SEVERITY:
+        ward = 'Intensivos'
+    elif speciality == 'Cirugía' or treatment == 'Observación':
+        ward = 'Recuperación'
+    else:
+        ward = 'General'
+    return speciality, ward
+
+def resource_demand_mix() -> Tuple[Dict[str, float], Dict[str, float]]:
+    """Fracción de pacientes que prefiere cada especialidad y sala, con diagnósticos y prioridades equiprobables"""
+    specialities = dict.fromkeys(SPECIALITIES, 0.0)
+    wards = dict.fromkeys(WARDS, 0.0)
+    combinations = list(itertools.product(PRIORITIES, CONDITIONS, TREATMENTS, range(1, 11)))
+    for priority, condition, treatment, severity in combinations:
+        patient = Patient(priority=priority, id=0, name="", registration_time=0.0,
+                          diagnosis={'condition': condition, 'recommended_treatment': treatment, 'severity': severity})
+        speciality, ward = preferred_resources(patient)
+        specialities[speciality] += 1 / len(combinations)
+        wards[ward] += 1 / len(combinations)
+    return specialities, wards
+
+# Composición de la plantilla y las camas: cada especialidad o sala en proporción a su demanda
+SPECIALITY_DEMAND, WARD_DEMAND = resource_demand_mix()
+
+# Etapas registradas en HospitalResources.stats, en orden del flujo
+STAGE_NAMES = {
+    'registration': "Registro",
+    'diagnosis_queue': "Cola de diagnóstico",
+    'diagnosis': "Diagnóstico",
+    'resource_check': "Consulta de disponibilidad",
+    'resource_wait': "Espera por doctor y cama",
+    'treatment': "Tratamiento",
+    'discharge': "Alta",
+    'bed_release': "Fin tratamiento → cama libre",
+    'system': "Total en sistema",
+}
+
+# Contadores de pacientes en HospitalResources.stats, en orden del flujo
+STAGE_COUNTERS = {
+    'registered': "registrados",
+    'diagnosed': "diagnosticados",
+    'discharged': "dados de alta",
+    'discharge_error': "errores en el alta",
+}
+
+# Tramos entre transiciones de estado del paciente y etapa de servicio que contienen;
+# lo que no es servicio es espera en cola (hilos de registro, workers, recursos, altas)
+STAGE_SPANS = [
+    ('registration', PatientStatus.WAITING_REGISTRATION, PatientStatus.REGISTERED, ['registration']),
+    ('diagnosis', PatientStatus.REGISTERED, PatientStatus.DIAGNOSED, ['diagnosis']),
+    ('allocation', PatientStatus.DIAGNOSED, PatientStatus.IN_TREATMENT, ['resource_check']),
+    ('treatment', PatientStatus.IN_TREATMENT, PatientStatus.READY_FOR_DISCHARGE, ['treatment']),
+    ('discharge', PatientStatus.READY_FOR_DISCHARGE, PatientStatus.DISCHARGED, ['discharge']),
+]
+SPAN_NAMES = {'registration': "Registro", 'diagnosis': "Diagnóstico", 'allocation': "Asignación de recursos",
+              'treatment': "Tratamiento", 'discharge': "Alta"}
+
+def record_stage_spans(patient: Patient, stats: ShardedStats, timeline: Optional[ConcurrencyTimeline] = None) -> None:
+    """Registra la duración (segundos simulados) de cada tramo del paciente dado de alta"""
+    times = patient.status_times
+    for span, start, end, _ in STAGE_SPANS:
+        if times[start.value] is not None and times[end.value] is not None:
+            stats.record(f'span:{span}', times[end.value] - times[start.value])
+            if timeline is not None:
+                timeline.add(span, times[start.value], times[end.value])
+
 # Recursos compartidos
 class HospitalResources:
-    def __init__(self, num_doctors=5, num_beds=10):
+    def __init__(self, num_doctors=5, num_beds=10, diagnosis_batch_size=1, diagnosis_batch_linger=0.01,
+                 diagnosis_transport='queue', resource_aging=None, prioritize_resources=True,
+                 allocation_mode='bundle', resource_matching=False, num_discharge_workers=4,
+                 release_policy='stage', num_registration_workers=5, registration_mode='threads',
+                 max_patients_in_system=None, matching_wait_limit=1.0):
         # Locks y Semáforos para threading
         self.registration_lock = threading.Lock() 
-        self.stats_lock = threading.Lock()
+        if registration_mode not in REGISTRATION_MODES:
+            raise ValueError(f"Modo de registro desconocido: {registration_mode} (opciones: {REGISTRATION_MODES})")
+        self.registration_mode = registration_mode
+        self.num_registration_workers = num_registration_workers # Hilos de RegWorker (modo 'threads')
+        # Límite de pacientes entre la admisión y el alta: la fuente de pacientes espera a que salga
+        # alguno, así la memoria queda acotada sea cual sea la duración de la simulación
+        self.max_patients_in_system = max_patients_in_system
+        self.admission = asyncio.Semaphore(max_patients_in_system) if max_patients_in_system else None
 
         # Locks y Semáforos para asyncio
         self.resource_lock = asyncio.Lock()
-        self.doctors_semaphore = asyncio.Semaphore(num_doctors)
-        self.beds_semaphore = asyncio.Semaphore(num_beds)
+        # Doctores y camas se conceden por prioridad del paciente (con envejecimiento opcional).
+        # En modo 'bundle' se reservan juntos; en 'sequential' se retiene el doctor mientras se espera cama
+        if allocation_mode not in ALLOCATION_MODES:
+            raise ValueError(f"Modo de asignación desconocido: {allocation_mode} (opciones: {ALLOCATION_MODES})")
+        self.allocation_mode = allocation_mode
+        if release_policy not in RELEASE_POLICIES:
+            raise ValueError(f"Política de liberación desconocida: {release_policy} (opciones: {RELEASE_POLICIES})")
+        self.release_policy = release_policy
+        self.num_doctors = num_doctors
+        self.num_beds = num_beds
+        # Identidad de cada doctor y cama: el allocator decide cuándo y de qué especialidad o sala,
+        # el pool cuál. Con resource_matching se eligen según el diagnóstico; si no, cualquiera libre
+        self.pools = {
+            'doctor': ResourcePool('doctor', 'speciality', SPECIALITIES, num_doctors, first_id=1001,
+                                   weights=SPECIALITY_DEMAND),
+            'bed': ResourcePool('bed', 'ward', WARDS, num_beds, first_id=101, weights=WARD_DEMAND),
+        }
+        self.resource_matching = resource_matching
+        # Latencias por etapa en segundos simulados y pacientes por etapa; cada hilo escribe en su shard sin locks
+        self.stats = ShardedStats()
+        # Segundos simulados que se espera un recurso adecuado antes de aceptar cualquiera libre (None = sin límite)
+        self.matching_wait_limit = matching_wait_limit
+        self.allocator = PriorityResourceAllocator(
+            {pool.key(value): count for pool in self.pools.values() for value, count in pool.capacity.items()},
+            resource_aging, prioritize_resources, stats=self.stats
+        )
+        self.assignment_stats = {'matched': 0, 'fallback': 0, 'constrained_misused': 0}
         
         # Colas
-        self.diagnosis_queue = multiprocessing.Queue()
+        # La cola de diagnóstico pertenece al pool de workers (ver attach_diagnosis_pool);
+        # diagnosis_transport solo se usa si hospital_simulation crea su propio pool
+        self.diagnosis_transport = diagnosis_transport
+        self.diagnosis_batch_size = diagnosis_batch_size
+        self.diagnosis_batch_linger = diagnosis_batch_linger
+        self.diagnosis_queue = None
+        self.diagnosis_batcher: Optional[DiagnosisBatcher] = None
         self.discharge_queue = asyncio.Queue()
+        self.num_discharge_workers = num_discharge_workers # Consumidores de discharge_queue (ver DischargeWorkers)
         
         # Contadores para estadísticas
         self.total_patients = 0
         self.processed_patients = 0
-        self.avg_wait_time = 0.0
+        self.diagnosis_handoff_latencies = StageStats() # Etapa 'handoff': segundos reales entre worker y bucle
+        self.diagnosis_wait_times = StageStats() # Una etapa por prioridad (nombre de Priority)
+        self.doctor_idle_hold_time = 0.0 # Segundos simulados con doctor asignado esperando cama
+        self.simulation_start = clock.now()
+        self.timeline = ConcurrencyTimeline(origin=self.simulation_start) # Pacientes en curso por tramo
+        
+        # Pacientes en diagnóstico por id: los workers solo reciben su registro compacto
+        self.pending_diagnosis: Dict[int, Patient] = {}
+
+    def resource_options(self, kind: str, preferred: str, relaxed: bool = False) -> List[str]:
+        """Especialidades o salas aceptables, en orden de preferencia (relaxed: y después cualquiera)"""
+        pool = self.pools[kind]
+        available = [value for value, count in pool.capacity.items() if count]
+        if not self.resource_matching:
+            return available
+        fallbacks = SPECIALITY_FALLBACKS if kind == 'doctor' else WARD_FALLBACKS
+        options = [value for value in [preferred] + fallbacks[preferred] if pool.capacity[value]]
+        if relaxed:
+            options += [value for value in available if value not in options]
+        return options or available # El hospital no tiene ninguno adecuado: sirve cualquiera
+
+    async def _acquire_matched(self, candidates: List[Dict[str, int]], relaxed: List[Dict[str, int]],
+                               priority: Priority, label: str) -> Dict[str, int]:
+        """Pide las alternativas adecuadas; pasado matching_wait_limit, también las demás (misma antigüedad)"""
+        if self.matching_wait_limit is None or len(relaxed) == len(candidates):
+            return await self.allocator.acquire(candidates, priority, label=label)
+        since = clock.now()
+        try:
+            return await asyncio.wait_for(self.allocator.acquire(candidates, priority, label=label, since=since),
+                                          clock.to_real(self.matching_wait_limit))
+        except asyncio.TimeoutError:
+            return await self.allocator.acquire(relaxed, priority, label=label, since=since)
+
+    @property
+    def avg_wait_time(self) -> float:
+        """Tiempo medio en sistema de los pacientes dados de alta"""
+        return self.stats.mean('system')
+
+    async def acquire_treatment_bundle(self, priority: Priority, speciality: str, ward: str) -> Tuple[dict, dict]:
+        """Espera hasta poder reservar a la vez un doctor y una cama compatibles (todo o nada)"""
+        doctors, beds = self.pools['doctor'], self.pools['bed']
+        candidates, relaxed = [[{doctors.key(s): 1, beds.key(w): 1}
+                                for s in self.resource_options('doctor', speciality, wide)
+                                for w in self.resource_options('bed', ward, wide)] for wide in (False, True)]
+        granted = await self._acquire_matched(candidates, relaxed, priority, 'bed+doctor')
+        values = dict(key.split(':', 1) for key in granted)
+        return doctors.acquire(values['doctor']), beds.acquire(values['bed'])
+
+    async def acquire_resource(self, kind: str, priority: Priority, preferred: str) -> dict:
+        """Espera por un doctor ('doctor') o una cama ('bed') compatible y devuelve su identidad"""
+        pool = self.pools[kind]
+        candidates, relaxed = [[{pool.key(value): 1} for value in self.resource_options(kind, preferred, wide)]
+                               for wide in (False, True)]
+        granted = await self._acquire_matched(candidates, relaxed, priority, kind)
+        return pool.acquire(next(iter(granted)).split(':', 1)[1])
+
+    def release_resource(self, kind: str, item: dict) -> None:
+        """Devuelve un doctor o una cama a su pool"""
+        pool = self.pools[kind]
+        pool.release(item)
+        self.allocator.release({pool.key(item[pool.attribute]): 1})
+
+    def record_assignment(self, speciality: str, ward: str, doctor: dict, bed: dict) -> None:
+        """Cuenta asignaciones exactas, alternativas y recursos escasos usados sin necesitarlos"""
+        matched = doctor['speciality'] == speciality and bed['ward'] == ward
+        self.assignment_stats['matched' if matched else 'fallback'] += 1
+        if (doctor['speciality'] == 'Cirugía' and speciality != 'Cirugía') or \
+                (bed['ward'] == 'Intensivos' and ward != 'Intensivos'):
+            self.assignment_stats['constrained_misused'] += 1
+
+    def utilization(self) -> Dict[str, float]:
+        """Fracción del tiempo simulado transcurrido en que doctores y camas estuvieron ocupados"""
+        elapsed = clock.elapsed(self.simulation_start)
+        if elapsed <= 0:
+            return {'doctor': 0.0, 'doctor_idle_hold': 0.0, 'bed': 0.0}
+        return {
+            'doctor': self.allocator.busy_time('doctor:') / (self.num_doctors * elapsed),
+            'doctor_idle_hold': self.doctor_idle_hold_time / (self.num_doctors * elapsed),
+            'bed': self.allocator.busy_time('bed:') / (self.num_beds * elapsed),
+        }
+
+    def resource_utilization(self, kind: str) -> Dict[int, float]:
+        """Utilización de cada doctor o cama por id"""
+        elapsed = clock.elapsed(self.simulation_start)
+        return {item_id: busy / elapsed if elapsed > 0 else 0.0
+                for item_id, busy in self.pools[kind].busy_time.items()}
+
+    def patient_exited(self) -> None:
+        """Libera la plaza de admisión de un paciente dado de alta o descartado por un error"""
+        if self.admission:
+            self.admission.release()
+
+    def attach_diagnosis_pool(self, pool: "DiagnosisWorkerPool") -> None:
+        """Envía los diagnósticos de esta simulación al pool indicado"""
+        if self.diagnosis_batch_size > pool.max_batch_size:
+            raise ValueError(f"Lotes de {self.diagnosis_batch_size} pacientes exceden el máximo del pool ({pool.max_batch_size})")
+        self.diagnosis_queue = pool.request_queue
+        # Con diagnosis_batch_size > 1 los pacientes viajan a los workers en lotes
+        self.diagnosis_batcher = (
+            DiagnosisBatcher(self.diagnosis_queue, self.diagnosis_batch_size, self.diagnosis_batch_linger)
+            if self.diagnosis_batch_size > 1 else None
+        )
 
 # 1. Proceso de Registro (Concurrente con Threads)
 def register_patient(patient: Patient, resources: HospitalResources) -> None:
     """Registra al paciente en el sistema hospitalario (implementación concurrente)"""
     processing_time = random.uniform(0.5, 1.5)
-    time.sleep(processing_time)
-    
-    with resources.registration_lock: # Protege total_patients y la asignación inicial
+    clock.sleep(processing_time)
+    complete_registration(patient, resources, processing_time)
+
+async def register_patient_async(patient: Patient, resources: HospitalResources) -> None:
+    """Registra al paciente como corrutina: miles de registros en curso sin un hilo por registro"""
+    processing_time = random.uniform(0.5, 1.5)
+    await clock.async_sleep(processing_time)
+    complete_registration(patient, resources, processing_time)
+
+def complete_registration(patient: Patient, resources: HospitalResources, processing_time: float) -> None:
+    """Asigna la gravedad al paciente registrado y lo envía a diagnóstico"""
+    resources.stats.record('registration', processing_time)
+    resources.stats.increment('registered')
+    with resources.registration_lock: # Solo el contador: el resto no comparte estado entre hilos
         resources.total_patients += 1
-        severity = random.choice([p for p in Priority])
-        patient.priority = severity
-        patient.status = PatientStatus.REGISTERED
-        print(f"Registrado: {patient}. Tiempo: {processing_time:.2f}s")
-        
-        resources.diagnosis_queue.put(patient)
+    patient.priority = random.choice(PRIORITIES)
+    patient.set_status(PatientStatus.REGISTERED)
     
-    print(f"Paciente {patient.id} esperando diagnóstico. Prioridad: {patient.priority.name}")
+    # pending_diagnosis es un dict (asignación atómica) y las colas y el batcher tienen sus propios locks
+    record = encode_diagnosis_request(patient)
+    resources.pending_diagnosis[patient.id] = patient
+    patient.set_status(PatientStatus.WAITING_DIAGNOSIS)
+    if resources.diagnosis_batcher:
+        resources.diagnosis_batcher.submit(record, patient.priority.value)
+    else:
+        resources.diagnosis_queue.put(record, patient.priority.value)
+    
+    log_event(logging.INFO, 'patient_registered',
+              "Paciente {patient_id} registrado y esperando diagnóstico. Prioridad: {priority}. Tiempo: {processing_time:.2f}s",
+              patient_id=patient.id, priority=patient.priority.name, processing_time=processing_time)
 
 # 2. Proceso de Diagnóstico (Paralelo con multiprocessing)
-def run_diagnosis_worker(diagnosis_queue: multiprocessing.Queue, result_queue: multiprocessing.Queue):
+def diagnose_patient(patient_id: int, priority: int, symptom_mask: int, queued_at: float,
+                     worker_clock: Optional[SimulationClock] = None) -> tuple:
+    """Simula el modelo de diagnóstico (carga de CPU) y devuelve los campos del resultado compacto"""
+    worker_clock = worker_clock or clock
+    queue_wait = worker_clock.elapsed(queued_at)
+    processing_time = random.uniform(1, 3)
+    if priority == WARMUP_PRIORITY:
+        processing_time = 0.0
+    worker_clock.sleep(processing_time)
+    
+    condition = random.randrange(len(CONDITIONS))
+    severity = random.randint(1, 10)
+    treatment = random.randrange(len(TREATMENTS))
+    log_event(logging.DEBUG, 'diagnosis_completed', "Diagnóstico completado: Paciente {patient_id}, Condición: {condition}",
+              patient_id=patient_id, condition=CONDITIONS[condition])
+    return patient_id, condition, severity, treatment, processing_time, queue_wait
+
+def run_diagnosis_worker(diagnosis_queue: PriorityDiagnosisQueue, result_queue: multiprocessing.Queue,
+                         worker_clock: Optional[SimulationClock] = None, ready_event=None, log_config=None):
     """Proceso trabajador para ejecutar diagnósticos en paralelo"""
-    print(f"Worker de diagnóstico {multiprocessing.current_process().name} iniciado.")
+    # El reloj (origen y escala) y el registro se reciben explícitamente: con 'spawn' el hijo no hereda globales
+    worker_clock = worker_clock or clock
+    configure_worker_logging(log_config)
+    worker_name = multiprocessing.current_process().name
+    log_event(logging.DEBUG, 'worker_started', "Worker de diagnóstico {worker} iniciado.", worker=worker_name)
+    if ready_event is not None:
+        ready_event.set()
     while True:
+        # Espera bloqueante sin timeout: el worker solo despierta con trabajo o con el centinela
+        message = diagnosis_queue.get()
+        if message is None: # Terminar el proceso
+            log_event(logging.DEBUG, 'worker_stopping', "Worker de diagnóstico {worker} recibiendo centinela y terminando.",
+                      worker=worker_name)
+            break
+
         try:
-            patient = diagnosis_queue.get(timeout=1) # Timeout para permitir finalización
-            if patient is None: # Terminar el proceso
-                print(f"Worker de diagnóstico {multiprocessing.current_process().name} recibiendo centinela y terminando.")
-                break
-            
-            patient.status = PatientStatus.WAITING_DIAGNOSIS # Actualizar estado
-            processing_time = random.uniform(1, 3)
-            time.sleep(processing_time)
-            
-            diagnosis = {
-                'condition': random.choice(['Gripe', 'Fractura', 'Apendicitis', 'COVID-19', 'Migraña']),
-                'severity': random.randint(1, 10),
-                'recommended_treatment': random.choice(['Medicamentos', 'Cirugía', 'Observación', 'Terapia']),
-                'processing_time': processing_time
-            }
-            
-            patient.diagnosis = diagnosis
-            patient.status = PatientStatus.DIAGNOSED
+            # Un lote (varios registros) se diagnostica completo y se devuelve como un único mensaje
+            results = [diagnose_patient(*request, worker_clock) for request in DIAGNOSIS_REQUEST.iter_unpack(message)]
             
-            result_queue.put(patient)
-            print(f"Diagnóstico completado: Paciente {patient.id}, Condición: {diagnosis['condition']}")
-        
-        except queue.Empty:
-            continue
+            completed_at = worker_clock.now() # Para medir la latencia de entrega al bucle principal
+            result_queue.put(b''.join(DIAGNOSIS_RESULT.pack(*result, completed_at) for result in results))
         except Exception as e:
-            print(f"Error en worker de diagnóstico {multiprocessing.current_process().name}: {e}")
+            log_event(logging.ERROR, 'worker_error', "Error en worker de diagnóstico {worker}: {error}",
+                      worker=worker_name, error=str(e))
             # Considerar si se debe re-encolar el paciente o manejar el error de otra forma
-            time.sleep(0.1)
-    print(f"Worker de diagnóstico {multiprocessing.current_process().name} finalizado.")
+    log_event(logging.DEBUG, 'worker_stopped', "Worker de diagnóstico {worker} finalizado.", worker=worker_name)
+
+def shutdown_diagnosis_workers(processes: List[multiprocessing.Process], diagnosis_queue: PriorityDiagnosisQueue,
+                               drain: bool = True, timeout: float = 5) -> None:
+    """Detiene los workers de diagnóstico con un centinela por proceso.
+
+    Con drain=True los centinelas se encolan detrás del trabajo pendiente, de modo
+    que los workers terminan todos los diagnósticos antes de salir. Con drain=False
+    se descarta primero el trabajo que aún no se ha empezado.
+    """
+    if not drain:
+        discarded = 0
+        while True:
+            try:
+                diagnosis_queue.get_nowait()
+                discarded += 1
+            except queue.Empty:
+                break
+        if discarded:
+            log_event(logging.INFO, 'diagnosis_discarded', "Descartados {discarded} diagnósticos pendientes.",
+                      discarded=discarded)
+
+    log_event(logging.DEBUG, 'workers_stopping', "Enviando centinelas a los workers de diagnóstico...")
+    for _ in processes:
+        diagnosis_queue.put(None)
+
+    log_event(logging.DEBUG, 'workers_joining', "Esperando a que los procesos de diagnóstico terminen...")
+    for p in processes:
+        p.join(timeout=timeout) # Esperar a que terminen limpiamente
+        if p.is_alive():
+            log_event(logging.WARNING, 'worker_terminated', "Proceso {worker} no terminó, forzando terminación.",
+                      worker=p.name)
+            p.terminate() # Como último recurso
+
+def default_diagnosis_workers() -> int:
+    """80% de los procesadores, y al menos un worker (en un contenedor de 1 CPU saldrían 0)"""
+    return max(1, int(multiprocessing.cpu_count()*0.8))
+
+class DiagnosisWorkerPool:
+    """Pool de procesos de diagnóstico de larga vida, reutilizable entre simulaciones.
+
+    Es dueño de las colas de petición y resultado. El coste de arranque (crear
+    procesos) y de calentamiento se mide aparte para no mezclarlo con el
+    rendimiento estable de cada simulación. Si max_workers > min_workers, el pool
+    se redimensiona durante cada simulación con un DiagnosisAutoscaler.
+    """
+    def __init__(self, num_workers: Optional[int] = None, transport: str = 'queue',
+                 max_batch_size: int = 1, worker_clock: Optional[SimulationClock] = None,
+                 min_workers: Optional[int] = None, max_workers: Optional[int] = None,
+                 target_wait: float = 5.0, priority_lanes: bool = True):
+        self.num_workers = num_workers if num_workers is not None else default_diagnosis_workers()
+        self.min_workers = max(1, min_workers if min_workers is not None else self.num_workers)
+        self.max_workers = max_workers if max_workers is not None else self.num_workers
+        if not self.min_workers <= self.num_workers <= self.max_workers:
+            raise ValueError(f"Se requiere min_workers <= num_workers <= max_workers "
+                             f"({self.min_workers}, {self.num_workers}, {self.max_workers})")
+        self.transport = transport
+        self.max_batch_size = max_batch_size
+        self.clock = worker_clock or clock # Fijo durante toda la vida del pool
+        self.request_queue = PriorityDiagnosisQueue(transport, max_batch_size, priority_lanes)
+        self.result_queue = create_diagnosis_queue(transport, DIAGNOSIS_RESULT, max_batch_size)
+        self.processes: List[multiprocessing.Process] = []
+        self._retiring = 0                 # Centinelas enviados a workers que aún no han salido
+        self._worker_ids = itertools.count()
+        self.service_time = 2.0            # Media móvil (EWMA) del tiempo de servicio simulado por mensaje
+        self.autoscaler = DiagnosisAutoscaler(self, target_wait) if self.max_workers > self.min_workers else None
+
+        # Métricas
+        self.startup_time = 0.0 # Segundos reales hasta que todos los workers están listos
+        self.warmup_time = 0.0  # Segundos reales del recorrido de calentamiento
+        self.runs = 0           # Simulaciones atendidas
+
+    @property
+    def active_workers(self) -> int:
+        return len(self.processes) - self._retiring
+
+    def start(self) -> None:
+        """Arranca los workers y espera a que todos estén listos"""
+        log_event(logging.INFO, 'pool_starting', "Iniciando {workers} procesos de diagnóstico...", workers=self.num_workers)
+        start_time = time.perf_counter()
+        ready_events = [self.add_worker() for _ in range(self.num_workers)]
+        for ready_event in ready_events:
+            ready_event.wait()
+        self.startup_time = time.perf_counter() - start_time
+        log_event(logging.INFO, 'pool_ready', "Pool de diagnóstico listo en {startup_ms:.1f}ms.",
+                  startup_ms=self.startup_time * 1000)
+
+    def add_worker(self):
+        """Arranca un worker más; devuelve el evento que marcará cuando esté listo"""
+        ready_event = worker_context.Event()
+        p = worker_context.Process(
+            target=run_diagnosis_worker,
+            args=(self.request_queue, self.result_queue, self.clock, ready_event, worker_logging_config()),
+            name=f"DiagWorker-{next(self._worker_ids)}"
+        )
+        p.start()
+        self.processes.append(p)
+        return ready_event
+
+    def retire_worker(self) -> None:
+        """Retira un worker con un centinela: saldrá al terminar el trabajo ya encolado"""
+        self._retiring += 1
+        self.request_queue.put(None)
+
+    def reap(self) -> None:
+        """Elimina de la lista los workers que ya han terminado"""
+        finished = [p for p in self.processes if not p.is_alive()]
+        for p in finished:
+            p.join()
+            self.processes.remove(p)
+        # Solo sale con código 0 el worker que recibió un centinela; uno caído no descuenta un retiro pendiente
+        retired = sum(1 for p in finished if p.exitcode == 0)
+        self._retiring = max(0, self._retiring - retired)
+
+    def queue_depth(self) -> int:
+        """Mensajes pendientes en la cola de peticiones"""
+        return self.request_queue.qsize()
+
+    def record_results(self, patients: List[Patient]) -> None:
+        """Actualiza el tiempo de servicio observado con un mensaje de resultados"""
+        message_service_time = sum(patient.diagnosis['processing_time'] for patient in patients)
+        self.service_time = 0.8 * self.service_time + 0.2 * message_service_time
+
+    def warm_up(self, num_requests: Optional[int] = None) -> None:
+        """Recorre la IPC con peticiones de calentamiento antes de medir (sin simulación en curso)"""
+        num_requests = num_requests or self.active_workers * 2
+        start_time = time.perf_counter()
+        for _ in range(num_requests):
+            self.request_queue.put(DIAGNOSIS_REQUEST.pack(0, WARMUP_PRIORITY, 0, self.clock.now()))
+        for _ in range(num_requests):
+            self.result_queue.get()
+        self.warmup_time = time.perf_counter() - start_time
+        log_event(logging.INFO, 'pool_warmed', "Pool de diagnóstico calentado en {warmup_ms:.1f}ms ({requests} peticiones).",
+                  warmup_ms=self.warmup_time * 1000, requests=num_requests)
+
+    def shutdown(self, drain: bool = True) -> None:
+        shutdown_diagnosis_workers(self.processes, self.request_queue, drain=drain)
+        self.processes = []
+        self._retiring = 0
+        self.request_queue.close()
+        self.result_queue.close()
+
+    def __enter__(self) -> "DiagnosisWorkerPool":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
+
+class DiagnosisAutoscaler:
+    """Ajusta el número de workers de un DiagnosisWorkerPool según la profundidad de la cola.
+
+    Estima cuántos workers hacen falta para vaciar la cola en target_wait segundos
+    simulados con el tiempo de servicio observado, dentro de [min_workers, max_workers].
+    Crece en cuanto llega una ráfaga y solo decrece tras scale_down_delay
+    comprobaciones seguidas con exceso de workers, de uno en uno.
+    """
+    def __init__(self, pool: DiagnosisWorkerPool, target_wait: float = 5.0,
+                 interval: float = 0.05, scale_down_delay: int = 5, history_size: int = 10_000):
+        self.pool = pool
+        self.target_wait = target_wait
+        self.interval = interval # Segundos reales entre comprobaciones
+        self.scale_down_delay = scale_down_delay
+        self.history: deque = deque(maxlen=history_size) # (instante, profundidad, workers activos), los más recientes
+
+    def desired_workers(self) -> int:
+        needed = math.ceil(self.pool.queue_depth() * self.pool.service_time / self.target_wait)
+        return min(self.pool.max_workers, max(self.pool.min_workers, needed))
+
+    async def run(self) -> None:
+        surplus_checks = 0
+        while True:
+            self.pool.reap()
+            desired = self.desired_workers()
+            active = self.pool.active_workers
+            if desired > active:
+                log_event(logging.INFO, 'autoscale', "Autoescalado: {active} → {desired} workers de diagnóstico",
+                          active=active, desired=desired)
+                for _ in range(desired - active):
+                    # Arrancar un proceso bloquea: fuera del bucle, que sigue entregando diagnósticos.
+                    # Se espera a que esté listo: su evento no puede destruirse antes de que el hijo lo abra
+                    await asyncio.get_running_loop().run_in_executor(None, lambda: self.pool.add_worker().wait())
+                surplus_checks = 0
+            elif desired < active:
+                surplus_checks += 1
+                if surplus_checks >= self.scale_down_delay:
+                    log_event(logging.INFO, 'autoscale', "Autoescalado: {active} → {desired} workers de diagnóstico",
+                              active=active, desired=active - 1)
+                    self.pool.retire_worker()
+                    surplus_checks = 0
+            else:
+                surplus_checks = 0
+            self.history.append((clock.now(), self.pool.queue_depth(), self.pool.active_workers))
+            await asyncio.sleep(self.interval)
+
+class DiagnosisResultBridge:
+    """Entrega los pacientes diagnosticados al bucle de asyncio en cuanto llegan.
+
+    Un hilo lector se bloquea en la cola de resultados (multiprocessing) y los
+    pasa al bucle con loop.call_soon_threadsafe; si hay varios disponibles a la
+    vez se entregan en un único callback, sin sondeos periódicos. Los resultados
+    compactos se incorporan a los Patient canónicos en el propio hilo lector.
+    """
+    def __init__(self, result_queue: multiprocessing.Queue, pending: Dict[int, Patient], max_batch_size: int = 64,
+                 on_results: Optional[Callable[[List[Patient]], None]] = None, stats: Optional[ShardedStats] = None):
+        self.result_queue = result_queue
+        self.pending = pending
+        self.stats = stats # Contador 'diagnosed', en el shard del hilo lector
+        self.on_results = on_results # Se invoca en el hilo lector con los pacientes de cada mensaje
+        self.max_batch_size = max_batch_size
+        self.handoff_latencies = StageStats() # Etapa 'handoff', en segundos reales
+        self.batches_delivered = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready: Optional[asyncio.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Queue()
+        self._thread = threading.Thread(target=self._read_results, name="DiagResultReader", daemon=True)
+        self._thread.start()
+
+    async def get(self) -> Optional[Patient]:
+        """Espera al siguiente paciente diagnosticado (None si se llamó a wake)"""
+        return await self._ready.get()
+
+    def wake(self) -> None:
+        """Despierta a quien espera en get sin entregar ningún paciente"""
+        self._ready.put_nowait(None)
+
+    async def stop(self) -> None:
+        """Detiene el hilo lector mediante un centinela en la cola de resultados"""
+        self.result_queue.put(None)
+        await self._loop.run_in_executor(None, self._thread.join)
+
+    def _read_results(self) -> None:
+        while True:
+            try:
+                batch = [self.result_queue.get()] # Bloqueante: solo despierta cuando hay resultados
+                # Agrupar todo lo que ya esté disponible en una sola entrega al bucle
+                while len(batch) < self.max_batch_size:
+                    try:
+                        batch.append(self.result_queue.get_nowait())
+                    except queue.Empty:
+                        break
+            except Exception as e:
+                log_event(logging.ERROR, 'result_reader_error', "Error leyendo la cola de resultados de diagnóstico: {error}",
+                          error=str(e))
+                return
+
+            stop = None in batch
+            patients = []
+            for message in batch:
+                if message is not None:
+                    # Decodificar fuera del bucle: al bucle solo llegan Patient ya actualizados
+                    merged = merge_diagnosis_results(message, self.pending)
+                    if self.stats is not None:
+                        self.stats.increment('diagnosed', len(merged))
+                    if self.on_results:
+                        self.on_results(merged)
+                    patients.extend(merged)
+            if patients:
+                self._loop.call_soon_threadsafe(self._deliver, patients)
+            if stop:
+                return
+
+    def _deliver(self, patients: List[Patient]) -> None:
+        # Se ejecuta en el hilo del bucle de asyncio
+        now = clock.now()
+        self.batches_delivered += 1
+        for patient in patients:
+            self.handoff_latencies.record('handoff', clock.to_real(now - patient.diagnosis.get('completed_at', now)))
+            self._ready.put_nowait(patient)
 
 
 # 3. Asignación de Recursos (Asíncrono con asyncio)
 async def allocate_resources(patient: Patient, resources: HospitalResources) -> None:
     """Asigna recursos como camas y médicos de forma asíncrona"""
-    print(f"Intentando asignar recursos para paciente {patient.id} (Prioridad: {patient.priority.name})...")
-    patient.status = PatientStatus.WAITING_RESOURCE
+    log_event(logging.DEBUG, 'allocation_started', "Intentando asignar recursos para paciente {patient_id} (Prioridad: {priority})...",
+              patient_id=patient.id, priority=patient.priority.name)
+    patient.set_status(PatientStatus.WAITING_RESOURCE)
     
     # Simular solicitud a sistema externo (API) para verificar disponibilidad
-    await asyncio.sleep(random.uniform(0.2, 0.8))
+    check_time = random.uniform(0.2, 0.8)
+    await clock.async_sleep(check_time)
+    resources.stats.record('resource_check', check_time)
     
     assigned_doctor = None
     assigned_bed = None
+    doctor_released = False
     try:
-        # Adquirir recursos necesarios
-        print(f"Paciente {patient.id} esperando por doctor...")
-        await resources.doctors_semaphore.acquire()
-        assigned_doctor = {'id': random.randint(1000, 9999), 'speciality': random.choice(['General', 'Urgencias', 'Cirugía'])}
-        print(f"Doctor {assigned_doctor['id']} asignado a Paciente {patient.id}.")
+        # Adquirir recursos compatibles con el diagnóstico
+        speciality, ward = preferred_resources(patient)
+        wait_start = clock.now()
+        if resources.allocation_mode == 'bundle':
+            # Doctor y cama a la vez: ningún doctor queda retenido esperando cama
+            log_event(logging.DEBUG, 'waiting_resources', "Paciente {patient_id} esperando por doctor ({speciality}) y cama ({ward})...",
+                      patient_id=patient.id, speciality=speciality, ward=ward)
+            assigned_doctor, assigned_bed = await resources.acquire_treatment_bundle(patient.priority, speciality, ward)
+        else:
+            log_event(logging.DEBUG, 'waiting_doctor', "Paciente {patient_id} esperando por doctor ({speciality})...",
+                      patient_id=patient.id, speciality=speciality)
+            assigned_doctor = await resources.acquire_resource('doctor', patient.priority, speciality)
+            log_event(logging.DEBUG, 'doctor_assigned', "Doctor {doctor_id} asignado a Paciente {patient_id}.",
+                      doctor_id=assigned_doctor['id'], patient_id=patient.id)
 
-        print(f"Paciente {patient.id} esperando por cama...")
-        await resources.beds_semaphore.acquire()
-        assigned_bed = {'id': random.randint(100, 999), 'ward': random.choice(['General', 'Intensivos', 'Recuperación'])}
-        print(f"Cama {assigned_bed['id']} asignada a Paciente {patient.id}.")
+            log_event(logging.DEBUG, 'waiting_bed', "Paciente {patient_id} esperando por cama ({ward})...",
+                      patient_id=patient.id, ward=ward)
+            hold_start = clock.now()
+            assigned_bed = await resources.acquire_resource('bed', patient.priority, ward)
+            resources.doctor_idle_hold_time += clock.elapsed(hold_start)
+        resources.record_assignment(speciality, ward, assigned_doctor, assigned_bed)
+        resources.stats.record('resource_wait', clock.elapsed(wait_start))
 
         async with resources.resource_lock:
             patient.assigned_resources = {
                 'doctor': assigned_doctor,
                 'bed': assigned_bed,
-                'assignment_time': time.time()
+                'assignment_time': clock.now()
             }
-            patient.status = PatientStatus.IN_TREATMENT
+            patient.set_status(PatientStatus.IN_TREATMENT)
         
-        print(f"Recursos asignados: Paciente {patient.id}, Doctor {assigned_doctor['id']}, Cama {assigned_bed['id']}")
+        log_event(logging.INFO, 'resources_assigned', "Recursos asignados: Paciente {patient_id}, Doctor {doctor_id}, Cama {bed_id}",
+                  patient_id=patient.id, doctor_id=assigned_doctor['id'], bed_id=assigned_bed['id'],
+                  speciality=assigned_doctor['speciality'], ward=assigned_bed['ward'])
         
         # Simular tratamiento
         treatment_time = random.uniform(2, 5) # Reducido
-        print(f"Paciente {patient.id} iniciando tratamiento ({treatment_time:.2f}s)...")
-        await asyncio.sleep(treatment_time)
+        log_event(logging.DEBUG, 'treatment_started', "Paciente {patient_id} iniciando tratamiento ({treatment_time:.2f}s)...",
+                  patient_id=patient.id, treatment_time=treatment_time)
+        await clock.async_sleep(treatment_time)
+        resources.stats.record('treatment', treatment_time)
         
-        patient.status = PatientStatus.READY_FOR_DISCHARGE
+        if resources.release_policy == 'stage':
+            # El trabajo del doctor termina con el tratamiento; la cama se libera en el alta
+            resources.release_resource('doctor', assigned_doctor)
+            doctor_released = patient.assigned_resources['doctor_released'] = True
+        patient.set_status(PatientStatus.READY_FOR_DISCHARGE)
+        patient.assigned_resources['ready_time'] = clock.now()
         await resources.discharge_queue.put(patient)
-        print(f"Paciente {patient.id} listo para alta después de {treatment_time:.2f}s de tratamiento")
+        log_event(logging.DEBUG, 'ready_for_discharge', "Paciente {patient_id} listo para alta después de {treatment_time:.2f}s de tratamiento",
+                  patient_id=patient.id, treatment_time=treatment_time)
 
     except Exception as e:
-        print(f"Error asignando recursos o durante tratamiento para Paciente {patient.id}: {e}")
+        log_event(logging.ERROR, 'allocation_error', "Error asignando recursos o durante tratamiento para Paciente {patient_id}: {error}",
+                  patient_id=patient.id, error=str(e))
         # Lógica de rollback: si se adquirieron algunos recursos, liberarlos
-        if assigned_doctor: # Implica que el semáforo de doctor fue adquirido
-            resources.doctors_semaphore.release()
-            print(f"Doctor liberado para Paciente {patient.id} debido a error.")
-        if assigned_bed: # Implica que el semáforo de cama fue adquirido
-            resources.beds_semaphore.release()
-            print(f"Cama liberada para Paciente {patient.id} debido a error.")
+        if assigned_doctor and not doctor_released: # Implica que el doctor fue adquirido
+            resources.release_resource('doctor', assigned_doctor)
+            log_event(logging.WARNING, 'resource_rollback', "Doctor liberado para Paciente {patient_id} debido a error.",
+                      patient_id=patient.id, resource='doctor')
+        if assigned_bed: # Implica que la cama fue adquirida
+            resources.release_resource('bed', assigned_bed)
+            log_event(logging.WARNING, 'resource_rollback', "Cama liberada para Paciente {patient_id} debido a error.",
+                      patient_id=patient.id, resource='bed')
+        resources.patient_exited()
         
 
 # 4. Proceso de Alta (Asíncrono con asyncio)
@@ -175,130 +1170,303 @@ async def process_discharge(resources: HospitalResources) -> None:
     while True:
         try:
             patient = await resources.discharge_queue.get()
+            if patient is None: # Centinela: DischargeWorkers retira este consumidor
+                resources.discharge_queue.task_done()
+                break
             
             discharge_time = random.uniform(0.5, 1)
-            await asyncio.sleep(discharge_time)
+            await clock.async_sleep(discharge_time)
             
-            # Liberar recursos
-            if 'doctor' in patient.assigned_resources and patient.assigned_resources['doctor']:
-                resources.doctors_semaphore.release()
-            if 'bed' in patient.assigned_resources and patient.assigned_resources['bed']:
-                resources.beds_semaphore.release()
+            # Devolver el doctor y la cama concretos a sus pools
+            if patient.assigned_resources.get('doctor') and not patient.assigned_resources.get('doctor_released'):
+                resources.release_resource('doctor', patient.assigned_resources['doctor'])
+            if patient.assigned_resources.get('bed'):
+                resources.release_resource('bed', patient.assigned_resources['bed'])
+                resources.stats.record('bed_release', clock.elapsed(patient.assigned_resources['ready_time']))
             
-            patient.status = PatientStatus.DISCHARGED
-            total_time_in_system = time.time() - patient.registration_time
+            patient.set_status(PatientStatus.DISCHARGED)
+            total_time_in_system = clock.elapsed(patient.registration_time)
             
-            # Actualizar estadísticas
-            with resources.stats_lock:
-                resources.processed_patients += 1
-                # Cálculo de media móvil
-                resources.avg_wait_time = (
-                    (resources.avg_wait_time * (resources.processed_patients - 1)) + total_time_in_system
-                ) / resources.processed_patients
+            # Actualizar estadísticas: solo este hilo (el del bucle) escribe en su shard, sin locks
+            resources.processed_patients += 1
+            resources.stats.record('discharge', discharge_time)
+            resources.stats.record('system', total_time_in_system)
+            resources.stats.increment('discharged')
+            record_stage_spans(patient, resources.stats, resources.timeline)
+            resources.patient_exited()
             
-            print(f"Paciente {patient.id} dado de alta. Tiempo total en sistema: {total_time_in_system:.2f}s. Stats: {resources.processed_patients}/{resources.total_patients}, AvgTime: {resources.avg_wait_time:.2f}s")
+            log_event(logging.INFO, 'patient_discharged',
+                      "Paciente {patient_id} dado de alta. Tiempo total en sistema: {time_in_system:.2f}s. Stats: {processed}/{total}",
+                      patient_id=patient.id, time_in_system=total_time_in_system,
+                      processed=resources.processed_patients, total=resources.total_patients)
             resources.discharge_queue.task_done()
         except asyncio.CancelledError:
-            print("Proceso de alta cancelado.")
+            log_event(logging.DEBUG, 'discharge_cancelled', "Proceso de alta cancelado.")
             break
         except Exception as e:
-            print(f"Error en proceso de alta: {e}")
+            log_event(logging.ERROR, 'discharge_error', "Error en proceso de alta: {error}", error=str(e))
+            resources.stats.increment('discharge_error')
             
 
+class DischargeWorkers:
+    """Conjunto de tareas process_discharge que consumen discharge_queue en paralelo.
+
+    scale_to ajusta el número de consumidores en caliente: crea tareas nuevas o
+    encola centinelas, de modo que un consumidor retirado termina el alta en curso
+    y las que estaban en cola antes de él.
+    """
+    def __init__(self, resources: HospitalResources):
+        self.resources = resources
+        self.size = 0
+        self._tasks: List[asyncio.Task] = []
+
+    def scale_to(self, count: int) -> None:
+        count = max(1, count)
+        self._tasks = [task for task in self._tasks if not task.done()]
+        for _ in range(count - self.size):
+            self._tasks.append(asyncio.create_task(process_discharge(self.resources)))
+        for _ in range(self.size - count):
+            self.resources.discharge_queue.put_nowait(None)
+        self.size = count
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self.size = 0
+
+
+def print_stage_stats(stats: StageStats) -> None:
+    """Imprime media, desviación y percentiles de cada etapa (segundos simulados)"""
+    print("Latencia por etapa (media ± desv, p50/p90/p99):")
+    for stage in STAGE_NAMES:
+        summary = stats.summary(stage)
+        if summary['count']:
+            print(f"  {STAGE_NAMES[stage]:<28} ({summary['count']:>6}): {summary['mean']:6.2f}s ± {summary['stddev']:5.2f}s, "
+                  f"{summary['p50']:.2f}s / {summary['p90']:.2f}s / {summary['p99']:.2f}s")
+
+def print_stage_counters(stats: StageStats) -> None:
+    """Imprime cuántos pacientes pasaron por cada etapa y las peticiones de recursos por tipo"""
+    flow = ", ".join(f"{name} {stats.counters[counter]}" for counter, name in STAGE_COUNTERS.items()
+                     if stats.counters.get(counter))
+    print(f"Pacientes por etapa: {flow}")
+    for label in sorted(counter.split(':', 1)[1] for counter in stats.counters if counter.startswith('granted:')):
+        print(f"  Peticiones de {label}: {stats.counters[f'granted:{label}']} concedidas, "
+              f"{stats.counters.get(f'queued:{label}', 0)} tuvieron que esperar, "
+              f"{stats.counters.get(f'cancelled:{label}', 0)} canceladas en espera")
+
+def print_stage_breakdown(stats: StageStats) -> None:
+    """Imprime, por tramo, cuánto del tiempo medio es servicio y cuánto espera en cola"""
+    print("Desglose por tramo (media total = servicio + cola, p99 total):")
+    for span, _, _, service_stages in STAGE_SPANS:
+        total = stats.summary(f'span:{span}')
+        if not total['count']:
+            continue
+        service = sum(stats.summary(stage)['mean'] for stage in service_stages)
+        queueing = max(0.0, total['mean'] - service)
+        share = queueing / total['mean'] if total['mean'] > 0 else 0.0
+        print(f"  {SPAN_NAMES[span]:<24} {total['mean']:7.2f}s = {service:6.2f}s servicio + {queueing:6.2f}s cola "
+              f"({share:4.0%} cola), p99 {total['p99']:.2f}s")
+
+def print_concurrency_timeline(timeline: ConcurrencyTimeline, rows: int = 12) -> None:
+    """Imprime los pacientes medios en curso por tramo a lo largo de la simulación (solapamiento de etapas)"""
+    first, last = timeline.bounds()
+    if last < first:
+        return
+    group = max(1, math.ceil((last - first + 1) / rows))
+    columns = {span: timeline.occupancy(span, group) for span, _, _, _ in STAGE_SPANS}
+    print("Pacientes en curso por tramo (media por intervalo):")
+    print("  " + f"{'desde':>8}" + "".join(f"{SPAN_NAMES[span][:13]:>14}" for span in columns))
+    for row in range(len(columns['registration'])):
+        start = (first + row * group) * timeline.bin_width
+        print(f"  {start:7.1f}s" + "".join(f"{occupancy[row]:14.1f}" for occupancy in columns.values()))
+    windows = {span: timeline.active_window(span) for span in columns}
+    print("  Actividad: " + ", ".join(f"{SPAN_NAMES[span]} {window[0]:.0f}-{window[1]:.0f}s"
+                                      for span, window in windows.items() if window))
+
+def print_wait_percentiles(title: str, wait_times: StageStats) -> None:
+    """Muestra p50/p90/p99 de los tiempos de espera de cada prioridad (una etapa por prioridad)"""
+    print(f"{title} por prioridad (p50/p90/p99):")
+    for priority in sorted(Priority, key=lambda p: p.value):
+        summary = wait_times.summary(priority.name)
+        if summary['count']:
+            print(f"  {priority.name:<8} ({summary['count']:>3} pacientes): {summary['p50']:.2f}s / "
+                  f"{summary['p90']:.2f}s / {summary['p99']:.2f}s")
+
+def generate_patients(num_patients: Optional[int] = None) -> Iterator[Patient]:
+    """Crea los pacientes bajo demanda, uno a uno (sin fin si num_patients es None)"""
+    for patient_id in itertools.count(1) if num_patients is None else range(1, num_patients + 1):
+        yield Patient(priority=Priority.MEDIUM, id=patient_id, name=f"Paciente_{patient_id}",
+                      symptoms=[random.choice(SYMPTOMS)])
+
+async def iterate_patients(patients: Union[Iterable[Patient], AsyncIterable[Patient]],
+                           limit: Optional[int] = None) -> AsyncIterator[Patient]:
+    """Recorre una fuente de pacientes síncrona o asíncrona, como mucho `limit` pacientes"""
+    if limit is not None and limit <= 0:
+        return
+    count = 0
+    if hasattr(patients, '__aiter__'):
+        async for patient in patients:
+            yield patient
+            count += 1
+            if count == limit:
+                return
+    else:
+        for patient in patients:
+            yield patient
+            count += 1
+            if count == limit:
+                return
+
+async def register_patients(patients: AsyncIterator[Patient], resources: HospitalResources,
+                            arrivals: Optional[ArrivalProcess] = None) -> None:
+    """Registra a los pacientes de la fuente sin bloquear el bucle (hilos vía run_in_executor o corrutinas).
+
+    Sin arrivals cada paciente entra en cuanto la fuente lo produce; con arrivals, en
+    su instante de llegada. Con max_patients_in_system la fuente solo avanza cuando
+    queda plaza. Los registros terminados se descartan en cuanto acaban.
+    """
+    loop = asyncio.get_running_loop()
+    executor = None
+    if resources.registration_mode == 'threads':
+        executor = ThreadPoolExecutor(max_workers=resources.num_registration_workers, thread_name_prefix="RegWorker")
+    arrival_times = arrivals.arrival_times() if arrivals else None
+    start = clock.now()
+    in_flight = set()
+
+    def registration_done(future: asyncio.Future) -> None:
+        in_flight.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            log_event(logging.ERROR, 'registration_error', "Error registrando paciente: {error}", error=str(future.exception()))
+            resources.patient_exited()
+
+    source = patients.__aiter__()
+    while True:
+        arrival = None
+        if arrival_times:
+            # Primero la llegada: el paciente llega a su hora aunque el hospital esté lleno
+            arrival = start + next(arrival_times)
+            delay = arrival - clock.now()
+            if delay > 0:
+                await clock.async_sleep(delay)
+        # Después la plaza y el paciente: la fuente no avanza mientras el hospital está lleno
+        if resources.admission:
+            await resources.admission.acquire()
+        try:
+            patient = await source.__anext__()
+        except StopAsyncIteration:
+            resources.patient_exited() # Plaza reservada que nadie ocupará
+            break
+        if arrival is not None:
+            # Su tiempo en sistema cuenta desde la llegada, incluida la espera por una plaza
+            patient.registration_time = arrival
+            patient.status = PatientStatus.WAITING_REGISTRATION
+            patient.status_times[PatientStatus.WAITING_REGISTRATION.value] = arrival
+        if executor:
+            registration = loop.run_in_executor(executor, register_patient, patient, resources)
+        else:
+            registration = asyncio.create_task(register_patient_async(patient, resources))
+        in_flight.add(registration)
+        registration.add_done_callback(registration_done)
+    await asyncio.gather(*in_flight, return_exceptions=True)
+    if executor:
+        executor.shutdown()
+    if resources.diagnosis_batcher:
+        resources.diagnosis_batcher.close() # Enviar el último lote parcial sin esperar al linger
+    log_event(logging.INFO, 'simulation_phase', "Todos los pacientes han sido registrados y enviados a diagnóstico.")
 
 # Función principal para orquestar todo el flujo
-async def hospital_simulation(num_patients: int, resources: HospitalResources):
-    """Coordina toda la simulación del hospital"""
-    diagnosis_result_queue = multiprocessing.Queue()
-    num_processors = int(multiprocessing.cpu_count()*0.8) # 80% de los procesadores
-    
-    diagnosis_processes = []
-    
-    print(f"Iniciando {num_processors} procesos de diagnóstico...")
-    for i in range(num_processors):
-        p = multiprocessing.Process(
-            target=run_diagnosis_worker, 
-            args=(resources.diagnosis_queue, diagnosis_result_queue),
-            name=f"DiagWorker-{i}"
+async def hospital_simulation(num_patients: Optional[int], resources: HospitalResources,
+                              diagnosis_pool: Optional[DiagnosisWorkerPool] = None,
+                              arrivals: Optional[ArrivalProcess] = None,
+                              patients: Optional[Union[Iterable[Patient], AsyncIterable[Patient]]] = None):
+    """Coordina toda la simulación del hospital.
+
+    patients es una fuente de pacientes (iterable o iterador asíncrono) que se consume
+    bajo demanda; por defecto se generan num_patients. Con num_patients=None se
+    consume la fuente entera. Con arrivals, las llegadas siguen un proceso en bucle abierto.
+    """
+    # Sin pool compartido se crea uno solo para esta simulación
+    owns_pool = diagnosis_pool is None
+    if owns_pool:
+        diagnosis_pool = DiagnosisWorkerPool(
+            transport=resources.diagnosis_transport, max_batch_size=resources.diagnosis_batch_size
         )
-        
-        p.start()
-        diagnosis_processes.append(p)
-    
-    discharge_task = asyncio.create_task(process_discharge(resources))
+        diagnosis_pool.start()
+    resources.attach_diagnosis_pool(diagnosis_pool)
+    diagnosis_pool.runs += 1
+    resources.simulation_start = clock.now() # Base para la utilización de doctores y camas
+    resources.timeline = ConcurrencyTimeline(origin=resources.simulation_start)
     
-    patients_to_register = [
-        Patient(
-            priority=Priority.MEDIUM,
-            id=i,
-            name=f"Paciente_{i}",
-            symptoms=[random.choice(["Fiebre", "Dolor", "Tos", "Mareo", "Fractura"])]
-        ) for i in range(1, num_patients + 1)
-    ]
+    result_bridge = DiagnosisResultBridge(diagnosis_pool.result_queue, resources.pending_diagnosis,
+                                          on_results=diagnosis_pool.record_results, stats=resources.stats)
+    result_bridge.start()
+    autoscaler_task = asyncio.create_task(diagnosis_pool.autoscaler.run()) if diagnosis_pool.autoscaler else None
+    discharge_workers = DischargeWorkers(resources)
+    discharge_workers.scale_to(resources.num_discharge_workers)
     
-    # Iniciar proceso de registro (concurrente con ThreadPoolExecutor)
-    print(f"Registrando {num_patients} pacientes...")
-    with ThreadPoolExecutor(max_workers=5, thread_name_prefix="RegWorker") as executor:
-        for patient in patients_to_register:
-            executor.submit(register_patient, patient, resources)
-    
-
-    print("Todos los pacientes han sido enviados a registro. Esperando diagnósticos...")
+    # El registro corre en segundo plano: la recogida de diagnósticos, la asignación y las altas
+    # empiezan con el primer paciente registrado en lugar de esperar al último
+    log_event(logging.INFO, 'simulation_phase', "Registrando pacientes (límite: {patients})...", patients=num_patients)
+    source = iterate_patients(patients if patients is not None else generate_patients(num_patients), num_patients)
+    registration_task = asyncio.create_task(register_patients(source, resources, arrivals))
+    # Al terminar el registro total_patients ya es definitivo: despertar la recogida para que lo compruebe
+    registration_task.add_done_callback(lambda _: result_bridge.wake())
+    log_event(logging.INFO, 'simulation_phase', "Registro en curso. Recogiendo diagnósticos...")
 
-    # Procesar resultados de diagnóstico y asignar recursos
-    allocation_tasks = []
+    # Procesar resultados de diagnóstico y asignar recursos; cada tarea se descarta al terminar
+    allocation_tasks = set()
     diagnosis_collected_count = 0
-    while diagnosis_collected_count < num_patients:
+    while not registration_task.done() or diagnosis_collected_count < resources.total_patients:
         try:
-            # Esperar por resultados de diagnóstico (no bloqueante en el bucle de asyncio)
-            if not diagnosis_result_queue.empty():
-                diagnosed_patient = diagnosis_result_queue.get_nowait()
-                diagnosis_collected_count += 1
-                print(f"Recogido paciente diagnosticado: {diagnosed_patient.id} ({diagnosis_collected_count}/{num_patients})")
-                # Asignar recursos de manera asíncrona
-                task = asyncio.create_task(allocate_resources(diagnosed_patient, resources))
-                allocation_tasks.append(task)
-            else:
-                # Si no hay nada en la cola, ceder control para que otras tareas asyncio puedan ejecutarse
-                await asyncio.sleep(0.1) 
-        except queue.Empty:
-             await asyncio.sleep(0.1)
+            # El puente despierta al bucle en cuanto hay un paciente diagnosticado
+            diagnosed_patient = await result_bridge.get()
+            if diagnosed_patient is None:
+                continue
+            diagnosis_collected_count += 1
+            resources.diagnosis_wait_times.record(diagnosed_patient.priority.name, diagnosed_patient.diagnosis['queue_wait'])
+            resources.stats.record('diagnosis_queue', diagnosed_patient.diagnosis['queue_wait'])
+            resources.stats.record('diagnosis', diagnosed_patient.diagnosis['processing_time'])
+            log_event(logging.DEBUG, 'diagnosis_collected', "Recogido paciente diagnosticado: {patient_id} ({collected}/{patients})",
+                      patient_id=diagnosed_patient.id, collected=diagnosis_collected_count, patients=resources.total_patients)
+            # Asignar recursos de manera asíncrona
+            task = asyncio.create_task(allocate_resources(diagnosed_patient, resources))
+            allocation_tasks.add(task)
+            task.add_done_callback(allocation_tasks.discard)
         except Exception as e:
-            print(f"Error procesando cola de diagnóstico o iniciando asignación: {e}")
-            await asyncio.sleep(0.1) # Pequeña pausa en caso de error
+            log_event(logging.ERROR, 'collection_error', "Error procesando cola de diagnóstico o iniciando asignación: {error}",
+                      error=str(e))
     
-    print("Todos los diagnósticos recogidos y tareas de asignación de recursos creadas.")
+    await registration_task
+    await result_bridge.stop()
+    if autoscaler_task:
+        autoscaler_task.cancel()
+        try:
+            await autoscaler_task
+        except asyncio.CancelledError:
+            pass
+    resources.diagnosis_handoff_latencies = result_bridge.handoff_latencies
+    log_event(logging.INFO, 'simulation_phase', "Todos los diagnósticos recogidos y tareas de asignación de recursos creadas.")
     
     # Esperar a que todas las tareas de asignación de recursos y tratamiento terminen
     if allocation_tasks:
-        await asyncio.gather(*allocation_tasks, return_exceptions=True)
-    print("Todas las tareas de asignación de recursos y tratamiento completadas.")
+        await asyncio.gather(*list(allocation_tasks), return_exceptions=True)
+    log_event(logging.INFO, 'simulation_phase', "Todas las tareas de asignación de recursos y tratamiento completadas.")
 
     # Esperar a que todos los pacientes sean dados de alta
-    print("Esperando a que todos los pacientes sean dados de alta...")
+    log_event(logging.INFO, 'simulation_phase', "Esperando a que todos los pacientes sean dados de alta...")
     # Esto se puede hacer esperando a que la cola de alta se vacíe y todas las tareas terminen
     await resources.discharge_queue.join() 
-    print(f"Cola de alta vacía. Pacientes procesados: {resources.processed_patients}/{num_patients}")
+    log_event(logging.INFO, 'simulation_phase', "Cola de alta vacía. Pacientes procesados: {processed}/{patients}",
+              processed=resources.processed_patients, patients=resources.total_patients)
     
-    # Asegurar que la tarea de alta termine si aún no lo ha hecho
-    if not discharge_task.done():
-        discharge_task.cancel()
-        try:
-            await discharge_task
-        except asyncio.CancelledError:
-            print("Tarea de alta confirmada como cancelada.")
+    # Detener los consumidores de alta
+    await discharge_workers.stop()
 
-    # Limpiar procesos de diagnóstico
-    print("Enviando centinelas a los workers de diagnóstico...")
-    for _ in range(num_processors):
-        resources.diagnosis_queue.put(None)
-    
-    print("Esperando a que los procesos de diagnóstico terminen...")
-    for p in diagnosis_processes:
-        p.join(timeout=5) # Esperar a que terminen limpiamente
-        if p.is_alive():
-            print(f"Proceso {p.name} no terminó, forzando terminación.")
-            p.terminate() # Como último recurso
+    # Limpiar procesos de diagnóstico (un pool compartido sigue vivo para la siguiente simulación)
+    if owns_pool:
+        diagnosis_pool.shutdown()
 
     # Mostrar estadísticas
     print("\n--- Estadísticas Finales del Hospital ---")
@@ -308,21 +1476,53 @@ async def hospital_simulation(num_patients: int, resources: HospitalResources):
         print(f"Tiempo promedio en sistema: {resources.avg_wait_time:.2f}s")
     else:
         print("No se procesaron pacientes para calcular tiempo promedio.")
+    handoff = result_bridge.handoff_latencies.summary('handoff')
+    if handoff['count']:
+        print(f"Latencia de entrega de diagnósticos: media {handoff['mean'] * 1000:.2f}ms, "
+              f"p99 {handoff['p99'] * 1000:.2f}ms, máx {handoff['max'] * 1000:.2f}ms "
+              f"({result_bridge.batches_delivered} entregas)")
+    print_wait_percentiles("Espera en cola de diagnóstico", resources.diagnosis_wait_times)
+    for kinds, wait_times in resources.allocator.wait_times.items():
+        print_wait_percentiles(f"Espera por {kinds}", wait_times)
+    utilization = resources.utilization()
+    print(f"Utilización ({resources.allocation_mode}, liberación {resources.release_policy}): doctores {utilization['doctor']:.0%} "
+          f"(retenidos esperando cama {utilization['doctor_idle_hold']:.0%}), camas {utilization['bed']:.0%}")
+    stage_stats = resources.stats.snapshot()
+    print_stage_stats(stage_stats)
+    print_stage_counters(stage_stats)
+    print_stage_breakdown(stage_stats)
+    print_concurrency_timeline(resources.timeline)
+    stats = resources.assignment_stats
+    print(f"Asignaciones: {stats['matched']} exactas, {stats['fallback']} con alternativa, "
+          f"{stats['constrained_misused']} con cirujano o cama de Intensivos sin necesitarlo")
+    bed_utilization = sorted(resources.resource_utilization('bed').values())
+    if bed_utilization:
+        print(f"Utilización por cama: mín {bed_utilization[0]:.0%}, mediana {percentile(bed_utilization, 50):.0%}, "
+              f"máx {bed_utilization[-1]:.0%}")
     print("--------------------------------")
 
 # Punto de entrada
 if __name__ == "__main__":
-    start_time = time.time()
+    start_time = time.perf_counter()
     print("Iniciando simulación del sistema hospitalario...")
     
     # Configuración de la simulación
     NUM_PATIENTS_TO_SIMULATE = 30
     NUM_DOCTORS = 5
     NUM_BEDS = 10
+    ARRIVAL_RATE = None         # Pacientes por segundo simulado (Poisson); None = todos llegan a la vez
+    SIMULATION_TIME_SCALE = 1.0 # 100 = cien veces más rápido que el tiempo real
+    LOG_LEVEL = logging.INFO    # logging.DEBUG muestra cada paso; None desactiva el registro de eventos
+    LOG_FILE = None             # p. ej. "eventos.jsonl" para guardar los eventos como JSON lines
 
+    set_time_scale(SIMULATION_TIME_SCALE)
+    configure_logging(level=LOG_LEVEL or logging.INFO, json_lines=LOG_FILE is not None, path=LOG_FILE,
+                      enabled=LOG_LEVEL is not None)
     hospital_resources = HospitalResources(num_doctors=NUM_DOCTORS, num_beds=NUM_BEDS)
     
-    asyncio.run(hospital_simulation(NUM_PATIENTS_TO_SIMULATE, hospital_resources))
+    arrivals = ArrivalProcess(ARRIVAL_RATE) if ARRIVAL_RATE else None
+    asyncio.run(hospital_simulation(NUM_PATIENTS_TO_SIMULATE, hospital_resources, arrivals=arrivals))
+    shutdown_logging()
     
-    end_time = time.time()
-    print(f"Simulación completada en {end_time - start_time:.2f} segundos.")
\ No newline at end of file
+    end_time = time.perf_counter()
+    print(f"Simulación completada en {end_time - start_time:.2f} segundos reales.")
\ No newline at end of file
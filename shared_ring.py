@@ -0,0 +1,97 @@
+import multiprocessing
+import queue
+import struct
+from multiprocessing import shared_memory
+from typing import Optional
+
+# Cola entre procesos sobre un buffer circular en memoria compartida.
+# Alternativa a multiprocessing.Queue para las colas de diagnóstico: no hay hilo
+# alimentador, ni pipe, ni pickle; los mensajes (bytes) se copian directamente a
+# ranuras de tamaño fijo. Dos semáforos cuentan ranuras libres y ocupadas y dos
+# locks independientes protegen la cabeza y la cola, de modo que productores y
+# consumidores no compiten entre sí.
+
+_HEADER = struct.Struct('<QQ')   # head (siguiente ranura a leer), tail (siguiente ranura a escribir)
+_LENGTH = struct.Struct('<I')    # Longitud del mensaje al inicio de cada ranura
+_SENTINEL_LENGTH = 0xFFFFFFFF    # Marca de centinela (None)
+
+
+class SharedMemoryQueue:
+    """Cola FIFO multiproductor/multiconsumidor de mensajes bytes en memoria compartida"""
+    def __init__(self, capacity: int = 4096, slot_size: int = 256, ctx=None):
+        ctx = ctx or multiprocessing.get_context()
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self._stride = _LENGTH.size + slot_size
+        self._shm = shared_memory.SharedMemory(create=True, size=_HEADER.size + capacity * self._stride)
+        _HEADER.pack_into(self._shm.buf, 0, 0, 0)
+        self._owner = True
+
+        self._items = ctx.Semaphore(0)        # Ranuras ocupadas
+        self._slots = ctx.Semaphore(capacity) # Ranuras libres
+        self._head_lock = ctx.Lock()          # Consumidores
+        self._tail_lock = ctx.Lock()          # Productores
+
+    def __getstate__(self):
+        # Solo se serializa al crear procesos (como los Lock/Semaphore que contiene)
+        return (self._shm.name, self.capacity, self.slot_size,
+                self._items, self._slots, self._head_lock, self._tail_lock)
+
+    def __setstate__(self, state):
+        name, self.capacity, self.slot_size, self._items, self._slots, self._head_lock, self._tail_lock = state
+        self._stride = _LENGTH.size + self.slot_size
+        self._shm = shared_memory.SharedMemory(name=name)
+        self._owner = False
+
+    def put(self, message: Optional[bytes], block: bool = True, timeout: Optional[float] = None) -> None:
+        """Encola un mensaje; None se transporta como centinela"""
+        if message is not None and len(message) > self.slot_size:
+            raise ValueError(f"Mensaje de {len(message)} bytes excede la ranura de {self.slot_size} bytes")
+        if not self._slots.acquire(block, timeout):
+            raise queue.Full
+
+        buf = self._shm.buf
+        with self._tail_lock:
+            tail = _HEADER.unpack_from(buf, 0)[1]
+            offset = _HEADER.size + (tail % self.capacity) * self._stride
+            if message is None:
+                _LENGTH.pack_into(buf, offset, _SENTINEL_LENGTH)
+            else:
+                _LENGTH.pack_into(buf, offset, len(message))
+                buf[offset + _LENGTH.size:offset + _LENGTH.size + len(message)] = message
+            struct.pack_into('<Q', buf, 8, tail + 1)
+        self._items.release()
+
+    def put_nowait(self, message: Optional[bytes]) -> None:
+        self.put(message, block=False)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Optional[bytes]:
+        """Desencola el mensaje más antiguo; lanza queue.Empty si no hay ninguno disponible"""
+        if not self._items.acquire(block, timeout):
+            raise queue.Empty
+
+        buf = self._shm.buf
+        with self._head_lock:
+            head = _HEADER.unpack_from(buf, 0)[0]
+            offset = _HEADER.size + (head % self.capacity) * self._stride
+            length = _LENGTH.unpack_from(buf, offset)[0]
+            message = None if length == _SENTINEL_LENGTH else bytes(buf[offset + _LENGTH.size:offset + _LENGTH.size + length])
+            struct.pack_into('<Q', buf, 0, head + 1)
+        self._slots.release()
+        return message
+
+    def get_nowait(self) -> Optional[bytes]:
+        return self.get(block=False)
+
+    def qsize(self) -> int:
+        head, tail = _HEADER.unpack_from(self._shm.buf, 0)
+        return tail - head
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def close(self) -> None:
+        """Libera el mapeo; el proceso que creó la cola además elimina el segmento"""
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,70 @@
+import asyncio
+import time
+from typing import Optional
+
+# Reloj único de la simulación.
+# Todas las marcas de tiempo (llegada, transiciones de estado, colas de
+# diagnóstico entre procesos, esperas por recursos, altas) se expresan en
+# segundos simulados medidos con time.monotonic(): no salta con ajustes de NTP
+# y en una misma máquina es común a todos los procesos, de modo que un worker de
+# diagnóstico puede restar una marca tomada en el proceso principal. El factor
+# de escala comprime el tiempo: con scale = 100 un segundo simulado dura 10 ms.
+
+class SimulationClock:
+    """Reloj monotónico en segundos simulados, con compresión temporal"""
+    def __init__(self, scale: float = 1.0, origin: Optional[float] = None):
+        if scale <= 0:
+            raise ValueError(f"El factor de escala temporal debe ser positivo: {scale}")
+        self.scale = scale
+        self.origin = time.monotonic() if origin is None else origin
+
+    def now(self) -> float:
+        """Segundos simulados desde el origen del reloj"""
+        return (time.monotonic() - self.origin) * self.scale
+
+    def elapsed(self, start: float) -> float:
+        """Segundos simulados transcurridos desde start (una marca de now())"""
+        return self.now() - start
+
+    def to_real(self, seconds: float) -> float:
+        """Segundos reales que dura un intervalo de segundos simulados"""
+        return seconds / self.scale
+
+    def sleep(self, seconds: float) -> None:
+        """Espera bloqueante de `seconds` segundos simulados"""
+        time.sleep(seconds / self.scale)
+
+    async def async_sleep(self, seconds: float) -> None:
+        """Espera asíncrona de `seconds` segundos simulados"""
+        await asyncio.sleep(seconds / self.scale)
+
+
+class ManualClock(SimulationClock):
+    """Reloj virtual que solo avanza explícitamente con advance/advance_to.
+
+    Es el reloj de la simulación de eventos discretos, que procesa los eventos en
+    orden y adelanta el reloj al siguiente. No sirve como reloj global de
+    hospital_simulation: varias esperas concurrentes no se pueden ordenar sin un
+    planificador, y cada proceso worker tendría su propia copia; por eso sleep y
+    async_sleep fallan en lugar de esperar.
+    """
+    def __init__(self, start: float = 0.0):
+        super().__init__(scale=1.0, origin=0.0)
+        self.current = start
+
+    def now(self) -> float:
+        return self.current
+
+    def advance(self, seconds: float) -> None:
+        self.advance_to(self.current + seconds)
+
+    def advance_to(self, instant: float) -> None:
+        if instant < self.current:
+            raise ValueError(f"El reloj no puede retroceder: {instant} < {self.current}")
+        self.current = instant
+
+    def sleep(self, seconds: float) -> None:
+        raise TypeError("ManualClock no admite esperas: avanza con advance_to desde la simulación de eventos discretos")
+
+    async def async_sleep(self, seconds: float) -> None:
+        self.sleep(seconds)
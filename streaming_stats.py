@@ -0,0 +1,320 @@
+import copy
+import math
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Estadísticas en streaming para la simulación del hospital.
+# Cada etapa acumula su media y varianza (Welford) y un histograma logarítmico
+# del que se obtienen p50/p90/p99 con error relativo acotado, sin guardar cada
+# muestra. Todas las estructuras se fusionan sumando, de modo que cada hilo (o
+# proceso) puede escribir en su propia copia sin locks y fusionarlas al final.
+
+class RunningStats:
+    """Media, varianza, mínimo y máximo en una pasada (algoritmo de Welford)"""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "RunningStats") -> "RunningStats":
+        """Combina otro acumulador en este (fórmula de Chan para la varianza)"""
+        if other.count == 0:
+            return self
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / total
+        self.mean += delta * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self) -> float:
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(self.variance)
+
+
+class LogHistogram:
+    """Histograma con cubetas de tamaño geométrico: cuantiles con error relativo acotado.
+
+    Un valor v cae en la cubeta ceil(log_gamma(v)), con gamma = (1+e)/(1-e), y se
+    reconstruye como el centro de la cubeta, a menos de e·v del original. La
+    memoria crece con el logaritmo del rango de valores, no con las muestras, y
+    dos histogramas con el mismo error se fusionan sumando cubetas.
+    """
+    MIN_VALUE = 1e-9 # Valores menores (incluido 0) se cuentan aparte
+
+    def __init__(self, relative_error: float = 0.01):
+        self.relative_error = relative_error
+        self._gamma = (1 + relative_error) / (1 - relative_error)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        if value < self.MIN_VALUE:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other: "LogHistogram") -> "LogHistogram":
+        if other.relative_error != self.relative_error:
+            raise ValueError("Solo se pueden fusionar histogramas con el mismo error relativo")
+        for index, count in dict(other.buckets).items(): # Copia: el otro puede seguir escribiendo
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def quantile(self, q: float) -> float:
+        """Valor aproximado del percentil q (0-100)"""
+        if self.count == 0:
+            return 0.0
+        rank = q / 100 * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self._gamma ** index / (self._gamma + 1)
+        return 2 * self._gamma ** max(self.buckets) / (self._gamma + 1)
+
+
+class StageStats:
+    """Contadores y distribución de latencias por etapa del flujo de pacientes"""
+    def __init__(self, relative_error: float = 0.01):
+        self.relative_error = relative_error
+        self.counters: Dict[str, int] = {}
+        self.stages: Dict[str, Tuple[RunningStats, LogHistogram]] = {}
+
+    def increment(self, counter: str, amount: int = 1) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def record(self, stage: str, value: float) -> None:
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = (RunningStats(), LogHistogram(self.relative_error))
+        entry[0].add(value)
+        entry[1].add(value)
+
+    def merge(self, other: "StageStats", stage: Optional[str] = None) -> "StageStats":
+        """Fusiona otro StageStats (o solo una de sus etapas) en este"""
+        if stage is None:
+            for counter, amount in dict(other.counters).items():
+                self.increment(counter, amount)
+        stages = [stage] if stage is not None else list(other.stages)
+        for name in stages:
+            entry = other.stages.get(name)
+            if entry is None:
+                continue
+            if name not in self.stages:
+                self.stages[name] = (RunningStats(), LogHistogram(self.relative_error))
+            self.stages[name][0].merge(entry[0])
+            self.stages[name][1].merge(entry[1])
+        return self
+
+    def summary(self, stage: str) -> Dict[str, float]:
+        """Número de muestras, media, desviación, mínimo, máximo y p50/p90/p99 de una etapa"""
+        entry = self.stages.get(stage)
+        if entry is None or entry[0].count == 0:
+            return {'count': 0, 'mean': 0.0, 'stddev': 0.0, 'min': 0.0, 'max': 0.0,
+                    'p50': 0.0, 'p90': 0.0, 'p99': 0.0}
+        running, histogram = entry
+        return {'count': running.count, 'mean': running.mean, 'stddev': running.stddev,
+                'min': running.min, 'max': running.max,
+                'p50': histogram.quantile(50), 'p90': histogram.quantile(90), 'p99': histogram.quantile(99)}
+
+
+class ShardedStats:
+    """Un StageStats por hilo: cada hilo escribe en el suyo sin locks y snapshot() los fusiona.
+
+    Los StageStats producidos en otros procesos (son serializables con pickle) se
+    incorporan con add_shard.
+    """
+    def __init__(self, relative_error: float = 0.01):
+        self.relative_error = relative_error
+        self._local = threading.local()
+        self._shards: List[StageStats] = []
+        self._shards_lock = threading.Lock() # Solo al crear el shard de un hilo nuevo
+
+    def shard(self) -> StageStats:
+        stats = getattr(self._local, 'stats', None)
+        if stats is None:
+            stats = self._local.stats = StageStats(self.relative_error)
+            self.add_shard(stats)
+        return stats
+
+    def add_shard(self, stats: StageStats) -> None:
+        with self._shards_lock:
+            self._shards.append(stats)
+
+    def increment(self, counter: str, amount: int = 1) -> None:
+        self.shard().increment(counter, amount)
+
+    def record(self, stage: str, value: float) -> None:
+        self.shard().record(stage, value)
+
+    def snapshot(self, stage: Optional[str] = None) -> StageStats:
+        """Fusión de todos los shards (o solo de una etapa)"""
+        merged = StageStats(self.relative_error)
+        for stats in list(self._shards):
+            merged.merge(stats, stage)
+        return merged
+
+    def summary(self, stage: str) -> Dict[str, float]:
+        return self.snapshot(stage).summary(stage)
+
+    def mean(self, stage: str) -> float:
+        """Media de una etapa sin fusionar histogramas (barato para consultas frecuentes)"""
+        running = RunningStats()
+        for stats in list(self._shards):
+            entry = stats.stages.get(stage)
+            if entry is not None:
+                running.merge(entry[0])
+        return running.mean
+
+    def counter(self, name: str) -> int:
+        return sum(stats.counters.get(name, 0) for stats in list(self._shards))
+
+
+class ConcurrencyTimeline:
+    """Pacientes en curso en cada tramo del flujo a lo largo del tiempo.
+
+    Cada tramo completado suma su solapamiento con los intervalos de bin_width
+    segundos que atraviesa; dividido por el ancho, da el número medio de pacientes
+    en ese tramo durante el intervalo. Los intervalos extremos guardan el
+    solapamiento parcial y los intermedios, cubiertos por completo, se anotan como
+    inicio y fin de cobertura, así que añadir un tramo cuesta lo mismo dure lo que
+    dure. Si la simulación ocupa más de max_bins intervalos, su ancho se duplica
+    fusionándolos de dos en dos: la memoria no depende ni del número de pacientes
+    ni de la duración.
+    """
+    def __init__(self, bin_width: float = 1.0, origin: float = 0.0, max_bins: int = 2048):
+        self.bin_width = bin_width
+        self.origin = origin
+        self.max_bins = max_bins
+        self.partial: Dict[str, Dict[int, float]] = {}  # Segundos·paciente en los intervalos extremos
+        self.starts: Dict[str, Dict[int, int]] = {}     # Primer intervalo cubierto por completo
+        self.ends: Dict[str, Dict[int, int]] = {}       # Primer intervalo que deja de estar cubierto
+        self._bounds: Optional[Tuple[int, int]] = None
+
+    def add(self, span: str, start: float, end: float) -> None:
+        start -= self.origin
+        end -= self.origin
+        while True:
+            first, last = math.floor(start / self.bin_width), math.floor(end / self.bin_width)
+            low, high = (first, last) if self._bounds is None else (min(self._bounds[0], first), max(self._bounds[1], last))
+            if high - low < self.max_bins:
+                break
+            self._coarsen()
+        self._bounds = (low, high)
+        partial = self.partial.setdefault(span, {})
+        if first == last:
+            partial[first] = partial.get(first, 0.0) + (end - start)
+            return
+        partial[first] = partial.get(first, 0.0) + ((first + 1) * self.bin_width - start)
+        partial[last] = partial.get(last, 0.0) + (end - last * self.bin_width)
+        if last > first + 1:
+            starts = self.starts.setdefault(span, {})
+            ends = self.ends.setdefault(span, {})
+            starts[first + 1] = starts.get(first + 1, 0) + 1
+            ends[last] = ends.get(last, 0) + 1
+
+    def _coarsen(self) -> None:
+        """Duplica el ancho de los intervalos fusionándolos de dos en dos"""
+        for span in list(self.partial):
+            partial: Dict[int, float] = {}
+            for index, busy in self.partial[span].items():
+                partial[index // 2] = partial.get(index // 2, 0.0) + busy
+            starts: Dict[int, int] = {}
+            for index, count in self.starts.get(span, {}).items():
+                # Cobertura que empieza en la segunda mitad: esa mitad pasa a ser parcial
+                if index % 2:
+                    partial[index // 2] = partial.get(index // 2, 0.0) + count * self.bin_width
+                    index += 1
+                starts[index // 2] = starts.get(index // 2, 0) + count
+            ends: Dict[int, int] = {}
+            for index, count in self.ends.get(span, {}).items():
+                # Cobertura que acaba tras la primera mitad: esa mitad pasa a ser parcial
+                if index % 2:
+                    partial[index // 2] = partial.get(index // 2, 0.0) + count * self.bin_width
+                ends[index // 2] = ends.get(index // 2, 0) + count
+            self.partial[span] = partial
+            self.starts[span] = starts
+            self.ends[span] = ends
+        self.bin_width *= 2
+        if self._bounds is not None:
+            self._bounds = (self._bounds[0] // 2, self._bounds[1] // 2)
+
+    def merge(self, other: "ConcurrencyTimeline") -> "ConcurrencyTimeline":
+        if other.origin != self.origin:
+            raise ValueError("Solo se pueden fusionar líneas temporales con el mismo origen")
+        other = copy.deepcopy(other)
+        while self.bin_width < other.bin_width:
+            self._coarsen()
+        while other.bin_width < self.bin_width:
+            other._coarsen()
+        if other.bin_width != self.bin_width:
+            raise ValueError("Los anchos de intervalo no son compatibles")
+        for source, target in ((other.partial, self.partial), (other.starts, self.starts), (other.ends, self.ends)):
+            for span, other_bins in source.items():
+                bins = target.setdefault(span, {})
+                for index, value in other_bins.items():
+                    bins[index] = bins.get(index, 0) + value
+        if other._bounds is not None:
+            self._bounds = other._bounds if self._bounds is None else (
+                min(self._bounds[0], other._bounds[0]), max(self._bounds[1], other._bounds[1]))
+        while self._bounds is not None and self._bounds[1] - self._bounds[0] >= self.max_bins:
+            self._coarsen()
+        return self
+
+    def bounds(self) -> Tuple[int, int]:
+        """Primer y último intervalo con actividad en algún tramo"""
+        return self._bounds if self._bounds is not None else (0, -1)
+
+    def busy_time(self, span: str) -> Dict[int, float]:
+        """Segundos·paciente en curso en cada intervalo"""
+        busy = dict(self.partial.get(span, {}))
+        starts, ends = self.starts.get(span, {}), self.ends.get(span, {})
+        covered = 0
+        first, last = self.bounds()
+        for index in range(first, last + 1):
+            covered += starts.get(index, 0) - ends.get(index, 0)
+            if covered:
+                busy[index] = busy.get(index, 0.0) + covered * self.bin_width
+        return busy
+
+    def occupancy(self, span: str, group: int = 1) -> List[float]:
+        """Pacientes medios en curso por intervalo, agrupando `group` intervalos consecutivos"""
+        first, last = self.bounds()
+        busy = self.busy_time(span)
+        return [sum(busy.get(index, 0.0) for index in range(start, min(start + group, last + 1)))
+                / (self.bin_width * min(group, last + 1 - start))
+                for start in range(first, last + 1, group)]
+
+    def active_window(self, span: str) -> Optional[Tuple[float, float]]:
+        """Instantes (desde el origen) del primer y último intervalo con actividad en el tramo"""
+        busy = [index for index, value in self.partial.get(span, {}).items() if value > 0]
+        if not busy:
+            return None
+        return min(busy) * self.bin_width, (max(busy) + 1) * self.bin_width
@@ -26,20 +26,42 @@ except ImportError:
     except Exception as e:
         print(f"Error instalando numpy: {e}")
         print("Por favor instala numpy manualmente: pip install numpy")
-from hospital_system import HospitalResources, hospital_simulation
+from hospital_system import (
+    HospitalResources, hospital_simulation, set_time_scale, get_clock, set_clock,
+    Patient, Priority, PatientStatus, DiagnosisBatcher, run_diagnosis_worker, shutdown_diagnosis_workers,
+    encode_diagnosis_request, merge_diagnosis_results, create_diagnosis_queue, PriorityDiagnosisQueue,
+    DIAGNOSIS_RESULT, SYMPTOMS, DiagnosisWorkerPool, percentile, print_wait_percentiles,
+    STAGE_SPANS, SPAN_NAMES, print_concurrency_timeline, register_patient, register_patient_async, PRIORITIES
+)
+import multiprocessing
+import pickle
+from hospital_des import run_discrete_event_simulation, EQUIVALENT_RESOURCE_OPTIONS
+from arrivals import ArrivalProcess, DiurnalRate, MassCasualtyBurst
+from streaming_stats import StageStats
+from simulation_clock import SimulationClock
+from event_log import configure_logging, shutdown_logging, log_event
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import random
+import threading
+import tracemalloc
 import subprocess
 import sys
 import os
 
-async def run_simulation_with_params(num_patients, num_doctors, num_beds):
+# Compresión temporal de las pruebas: los tiempos reportados siguen en segundos simulados
+TIME_SCALE = 100
+
+async def run_simulation_with_params(num_patients, num_doctors, num_beds, diagnosis_pool=None, arrivals=None,
+                                     **resource_options):
     """Ejecuta una simulación con parámetros específicos y devuelve métricas"""
-    start_time = time.time()
+    clock = get_clock()
+    start_time = clock.now()
     
-    resources = HospitalResources(num_doctors=num_doctors, num_beds=num_beds)
-    await hospital_simulation(num_patients, resources)
+    resources = HospitalResources(num_doctors=num_doctors, num_beds=num_beds, **resource_options)
+    await hospital_simulation(num_patients, resources, diagnosis_pool, arrivals)
     
-    end_time = time.time()
-    total_time = end_time - start_time
+    total_time = clock.elapsed(start_time)
     
     return {
         "total_time": total_time,
@@ -47,10 +69,17 @@ async def run_simulation_with_params(num_patients, num_doctors, num_beds):
         "patients": num_patients,
         "doctors": num_doctors,
         "beds": num_beds,
-        "throughput": num_patients / total_time
+        "throughput": num_patients / total_time,
+        "utilization": resources.utilization(),
+        "bed_utilization": resources.resource_utilization('bed'),
+        "assignment_stats": dict(resources.assignment_stats),
+        "bed_release": resources.stats.summary('bed_release'),
+        "stage_stats": resources.stats.snapshot(),
+        "timeline": resources.timeline,
+        "avg_handoff_latency": resources.diagnosis_handoff_latencies.summary('handoff')['mean']
     }
 
-async def test_patient_scaling():
+async def test_patient_scaling(diagnosis_pool=None):
     """Prueba el rendimiento con diferente número de pacientes"""
     results = []
     
@@ -59,13 +88,13 @@ async def test_patient_scaling():
     
     for count in patient_counts:
         print(f"\n--- Prueba con {count} pacientes ---")
-        result = await run_simulation_with_params(count, 5, 10)
+        result = await run_simulation_with_params(count, 5, 10, diagnosis_pool)
         results.append(result)
         print(f"Tiempo total: {result['total_time']:.2f}s, Tiempo promedio por paciente: {result['avg_wait_time']:.2f}s")
     
     return results
 
-async def test_resource_scaling():
+async def test_resource_scaling(diagnosis_pool=None):
     """Prueba el rendimiento con diferentes cantidades de recursos"""
     results = []
     
@@ -77,12 +106,683 @@ async def test_resource_scaling():
     
     for doctors, beds in resource_configs:
         print(f"\n--- Prueba con {doctors} doctores y {beds} camas ---")
-        result = await run_simulation_with_params(num_patients, doctors, beds)
+        result = await run_simulation_with_params(num_patients, doctors, beds, diagnosis_pool)
         results.append(result)
         print(f"Tiempo total: {result['total_time']:.2f}s, Tiempo promedio por paciente: {result['avg_wait_time']:.2f}s")
     
     return results
 
+async def test_persistent_pool():
+    """Compara crear procesos de diagnóstico en cada simulación frente a reutilizar un pool"""
+    num_runs = 5
+    num_patients = 10
+    
+    print("\n--- Pool nuevo en cada simulación ---")
+    start_time = time.perf_counter()
+    for _ in range(num_runs):
+        await run_simulation_with_params(num_patients, 5, 10)
+    fresh_time = time.perf_counter() - start_time
+    
+    print("\n--- Pool persistente ---")
+    with DiagnosisWorkerPool() as pool:
+        pool.warm_up()
+        start_time = time.perf_counter()
+        for _ in range(num_runs):
+            await run_simulation_with_params(num_patients, 5, 10, pool)
+        steady_time = time.perf_counter() - start_time
+    
+    result = {
+        "fresh_time": fresh_time,
+        "startup_time": pool.startup_time,
+        "warmup_time": pool.warmup_time,
+        "steady_time": steady_time,
+        "runs": num_runs
+    }
+    print(f"\n{num_runs} simulaciones con pool nuevo: {fresh_time:.2f}s reales")
+    print(f"Pool persistente: arranque {pool.startup_time * 1000:.1f}ms, calentamiento {pool.warmup_time * 1000:.1f}ms, "
+          f"{num_runs} simulaciones en {steady_time:.2f}s reales ({steady_time / num_runs * 1000:.1f}ms por simulación)")
+    return result
+
+async def test_diagnosis_autoscaling():
+    """Compara pools fijos con un pool autoescalado ante una ráfaga de pacientes"""
+    results = []
+    
+    num_patients = 40
+    max_workers = max(4, multiprocessing.cpu_count())
+    pool_configs = [
+        ("Fijo mínimo", dict(num_workers=1)),
+        ("Fijo máximo", dict(num_workers=max_workers)),
+        ("Autoescalado", dict(num_workers=1, min_workers=1, max_workers=max_workers, target_wait=3.0)),
+    ]
+    
+    for label, config in pool_configs:
+        print(f"\n--- Pool de diagnóstico: {label} ---")
+        with DiagnosisWorkerPool(**config) as pool:
+            result = await run_simulation_with_params(num_patients, 5, 10, pool)
+            history = pool.autoscaler.history if pool.autoscaler else []
+        workers = [h[2] for h in history] or [pool.num_workers]
+        result.update({"pool": label, "peak_workers": max(workers), "mean_workers": sum(workers) / len(workers)})
+        results.append(result)
+        print(f"{label}: tiempo promedio por paciente {result['avg_wait_time']:.2f}s, "
+              f"workers pico {result['peak_workers']}, medio {result['mean_workers']:.1f}")
+    
+    return results
+
+async def test_diagnosis_priority():
+    """Compara la espera en la cola de diagnóstico por prioridad: carriles por prioridad frente a FIFO"""
+    results = []
+    
+    num_patients = 60
+    
+    for priority_lanes in (False, True):
+        label = "Carriles por prioridad" if priority_lanes else "FIFO"
+        print(f"\n--- Cola de diagnóstico: {label} ---")
+        resources = HospitalResources(num_doctors=5, num_beds=10)
+        # Pocos workers para que la cola de diagnóstico se sature
+        with DiagnosisWorkerPool(num_workers=2, priority_lanes=priority_lanes) as pool:
+            await hospital_simulation(num_patients, resources, pool)
+        
+        summary = {"queue": label}
+        for priority in sorted(Priority, key=lambda p: p.value):
+            waits = resources.diagnosis_wait_times.summary(priority.name)
+            summary[priority.name] = {q: waits[f'p{q}'] for q in (50, 90, 99)}
+        results.append(summary)
+    
+    print("\nEspera en cola de diagnóstico (s simulados, p50/p90/p99):")
+    for summary in results:
+        print(f"{summary['queue']}:")
+        for priority in sorted(Priority, key=lambda p: p.value):
+            p = summary[priority.name]
+            print(f"  {priority.name:<8} {p[50]:6.2f} / {p[90]:6.2f} / {p[99]:6.2f}")
+    
+    return results
+
+async def test_resource_priority(diagnosis_pool=None):
+    """Compara la espera por recursos según prioridad: FIFO, por prioridad y por prioridad con envejecimiento"""
+    results = []
+    
+    num_patients = 30
+    configs = [
+        ("FIFO", dict(prioritize_resources=False)),
+        ("Prioridad", dict()),
+        ("Prioridad + envejecimiento (30s)", dict(resource_aging=30.0)),
+    ]
+    
+    for label, config in configs:
+        print(f"\n--- Asignación de recursos: {label} ---")
+        # Recursos escasos para que haya cola por doctor
+        resources = HospitalResources(num_doctors=2, num_beds=4, **config)
+        await hospital_simulation(num_patients, resources, diagnosis_pool)
+        results.append({"policy": label, "avg_wait_time": resources.avg_wait_time,
+                        "resource_wait_times": resources.allocator.wait_times})
+    
+    for result in results:
+        print(f"\n{result['policy']} (tiempo promedio en sistema {result['avg_wait_time']:.2f}s)")
+        for kinds, wait_times in result["resource_wait_times"].items():
+            print_wait_percentiles(f"Espera por {kinds}", wait_times)
+    
+    return results
+
+async def test_allocation_modes(diagnosis_pool=None):
+    """Compara asignación secuencial (doctor y luego cama) frente a atómica (doctor+cama)"""
+    results = []
+    
+    num_patients = 20
+    # Configuraciones de test_resource_scaling y, además, casos con camas escasas
+    resource_configs = [(2, 4), (3, 6), (5, 10), (8, 16), (10, 20), (4, 2), (8, 4)]
+    
+    for doctors, beds in resource_configs:
+        for mode in ('sequential', 'bundle'):
+            print(f"\n--- Asignación {mode} con {doctors} doctores y {beds} camas ---")
+            result = await run_simulation_with_params(num_patients, doctors, beds, diagnosis_pool, allocation_mode=mode)
+            result["mode"] = mode
+            results.append(result)
+    
+    print("\nDoctores/camas  modo        throughput  doctores (retenidos sin cama)  camas")
+    for result in results:
+        utilization = result["utilization"]
+        print(f"{result['doctors']:>3}/{result['beds']:<3}         {result['mode']:<10}  "
+              f"{result['throughput']:8.3f}/s  {utilization['doctor']:6.0%} ({utilization['doctor_idle_hold']:4.0%})"
+              f"                {utilization['bed']:5.0%}")
+    
+    return results
+
+async def test_resource_matching(diagnosis_pool=None):
+    """Compara la asignación de doctor y cama según diagnóstico frente a cualquiera libre"""
+    results = []
+    
+    num_patients = 40
+    resource_configs = [(3, 6), (5, 10), (6, 9), (9, 12)]
+    # (etiqueta, resource_matching, matching_wait_limit): sin límite, un escaso ocupado nunca cede
+    variants = [("cualquiera libre", False, None), ("diagnóstico", True, None), ("diagnóstico ≤1s", True, 1.0)]
+    
+    for doctors, beds in resource_configs:
+        for label, matching, wait_limit in variants:
+            print(f"\n--- Asignación {label} con {doctors} doctores y {beds} camas ---")
+            result = await run_simulation_with_params(num_patients, doctors, beds, diagnosis_pool,
+                                                      resource_matching=matching, matching_wait_limit=wait_limit)
+            result["matching"] = label
+            results.append(result)
+    
+    print("\nDoctores/camas  asignación         tiempo medio  exactas  alternativa  escasos mal usados")
+    for result in results:
+        stats = result["assignment_stats"]
+        print(f"{result['doctors']:>3}/{result['beds']:<3}         {result['matching']:<17}  "
+              f"{result['avg_wait_time']:10.2f}s  {stats['matched']:7}  {stats['fallback']:11}  "
+              f"{stats['constrained_misused']:18}")
+    
+    return results
+
+async def test_discharge_scaling(diagnosis_pool=None):
+    """Mide la latencia de liberación de cama con distinto número de consumidores de alta"""
+    results = []
+    
+    # Recursos abundantes para que el alta sea el cuello de botella
+    num_patients = 60
+    worker_counts = [1, 2, 4, 8]
+    
+    for workers in worker_counts:
+        print(f"\n--- Alta con {workers} consumidores ---")
+        result = await run_simulation_with_params(num_patients, 20, 40, diagnosis_pool,
+                                                  num_discharge_workers=workers)
+        result["discharge_workers"] = workers
+        results.append(result)
+    
+    print("\nConsumidores  throughput  liberación de cama p50 / p99 / máx")
+    for result in results:
+        release = result["bed_release"]
+        print(f"{result['discharge_workers']:>12}  {result['throughput']:8.3f}/s  "
+              f"{release['p50']:6.2f}s / {release['p99']:6.2f}s / {release['max']:6.2f}s")
+    
+    return results
+
+async def test_release_policies(diagnosis_pool=None):
+    """Compara liberar el doctor al terminar el tratamiento frente a liberarlo en el alta"""
+    results = []
+    
+    num_patients = 30
+    # Doctores escasos y, en el último caso, un solo consumidor de alta para alargar la espera
+    configs = [(2, 4, 4), (3, 6, 4), (5, 10, 4), (3, 6, 1)]
+    
+    for doctors, beds, discharge_workers in configs:
+        for policy in ('discharge', 'stage'):
+            print(f"\n--- Liberación '{policy}' con {doctors} doctores, {beds} camas y {discharge_workers} consumidores de alta ---")
+            result = await run_simulation_with_params(num_patients, doctors, beds, diagnosis_pool,
+                                                      release_policy=policy, num_discharge_workers=discharge_workers)
+            result["policy"] = policy
+            result["discharge_workers"] = discharge_workers
+            results.append(result)
+    
+    print("\nDoctores/camas/altas  liberación  throughput  tiempo medio  doctores  camas")
+    for result in results:
+        utilization = result["utilization"]
+        print(f"{result['doctors']:>3}/{result['beds']:<3}/{result['discharge_workers']:<3}           "
+              f"{result['policy']:<10}  {result['throughput']:8.3f}/s  {result['avg_wait_time']:10.2f}s  "
+              f"{utilization['doctor']:8.0%}  {utilization['bed']:5.0%}")
+    
+    return results
+
+async def test_stage_breakdown(diagnosis_pool=None):
+    """Identifica la etapa cuello de botella (más espera en cola) según la carga"""
+    results = []
+    
+    patient_counts = [10, 30, 60]
+    
+    for count in patient_counts:
+        print(f"\n--- Desglose por etapa con {count} pacientes ---")
+        result = await run_simulation_with_params(count, 5, 10, diagnosis_pool)
+        stats = result["stage_stats"]
+        queueing = {}
+        for span, _, _, service_stages in STAGE_SPANS:
+            total = stats.summary(f'span:{span}')['mean']
+            service = sum(stats.summary(stage)['mean'] for stage in service_stages)
+            queueing[span] = max(0.0, total - service)
+        result["queueing"] = queueing
+        results.append(result)
+    
+    print("\nPacientes  " + "  ".join(f"{SPAN_NAMES[span][:12]:>12}" for span, *_ in STAGE_SPANS) + "  cuello de botella")
+    for result in results:
+        queueing = result["queueing"]
+        bottleneck = max(queueing, key=queueing.get)
+        print(f"{result['patients']:>9}  " + "  ".join(f"{queueing[span]:11.2f}s" for span, *_ in STAGE_SPANS)
+              + f"  {SPAN_NAMES[bottleneck]}")
+    
+    return results
+
+async def test_registration_pipeline(diagnosis_pool=None):
+    """Comprueba que diagnóstico, asignación y alta avanzan mientras el registro sigue en curso"""
+    results = []
+    
+    num_patients = 100
+    
+    for mode in ('threads', 'asyncio'):
+        print(f"\n--- Registro en modo {mode} ---")
+        result = await run_simulation_with_params(num_patients, 20, 40, diagnosis_pool, registration_mode=mode)
+        timeline = result["timeline"]
+        registration = timeline.active_window('registration')
+        treatment = timeline.active_window('treatment')
+        result["registration_mode"] = mode
+        result["overlap"] = max(0.0, registration[1] - treatment[0]) if registration and treatment else 0.0
+        results.append(result)
+    
+    print("\nModo      tiempo total  registro activo  primer tratamiento  solapamiento")
+    for result in results:
+        timeline = result["timeline"]
+        registration = timeline.active_window('registration')
+        treatment = timeline.active_window('treatment')
+        print(f"{result['registration_mode']:<8} {result['total_time']:10.2f}s  {registration[0]:5.0f}-{registration[1]:.0f}s"
+              f"  {treatment[0]:17.0f}s  {result['overlap']:11.0f}s")
+    print_concurrency_timeline(results[0]["timeline"])
+    
+    return results
+
+async def test_offered_load():
+    """Latencia en sistema según la carga ofrecida (llegadas de Poisson) en lugar del tamaño del lote"""
+    results = []
+    
+    num_doctors, num_beds, num_diagnosis_workers = 5, 10, 8
+    # Pacientes/s simulados que admite cada etapa: servidores / tiempo medio que retiene cada uno
+    # (el doctor se libera al terminar el tratamiento; la cama, tras el alta)
+    stage_capacity = {
+        "registro": 5 / 1.0,
+        "diagnóstico": num_diagnosis_workers / 2.0,
+        "doctores": num_doctors / 3.5,
+        "camas": num_beds / (3.5 + 0.75),
+    }
+    bottleneck = min(stage_capacity, key=stage_capacity.get)
+    capacity = stage_capacity[bottleneck]
+    loads = [0.5, 0.8, 0.95, 1.1]
+    
+    # Misma configuración que el modelo de eventos discretos: recursos FIFO sin emparejamiento, mismos workers
+    with DiagnosisWorkerPool(num_workers=num_diagnosis_workers) as pool:
+        pool.warm_up()
+        for load in loads:
+            rate = load * capacity
+            result = await run_simulation_with_params(150, num_doctors, num_beds, pool,
+                                                      arrivals=ArrivalProcess(rate, seed=42),
+                                                      **EQUIVALENT_RESOURCE_OPTIONS)
+            system = result["stage_stats"].summary('system')
+            des = run_discrete_event_simulation(20_000, num_doctors, num_beds,
+                                                num_diagnosis_workers=num_diagnosis_workers, seed=42,
+                                                arrivals=ArrivalProcess(rate, seed=42))
+            results.append({"load": load, "rate": rate, "mean": system['mean'], "p99": system['p99'],
+                            "des_mean": des['avg_wait_time']})
+    print(f"\nCapacidad estimada: {capacity:.2f} pacientes/s simulados (limitada por {bottleneck})")
+    print("Carga   tasa       simulación real (150): media / p99      eventos discretos (20k): media")
+    for result in results:
+        print(f"{result['load']:4.0%}  {result['rate']:5.2f}/s  {result['mean']:24.2f}s / {result['p99']:6.2f}s"
+              f"  {result['des_mean']:26.2f}s")
+    
+    return results
+
+async def test_arrival_patterns(diagnosis_pool=None):
+    """Compara llegadas de Poisson, con curva diaria comprimida y con una ráfaga de víctimas en masa"""
+    results = []
+    
+    num_patients = 120
+    patterns = {
+        "Poisson 1/s": ArrivalProcess(1.0, seed=7),
+        "Curva diaria (periodo 60s)": ArrivalProcess(DiurnalRate(1.0, amplitude=0.8, period=60), seed=7),
+        "Poisson 0.5/s + ráfaga de 40": ArrivalProcess(0.5, bursts=[MassCasualtyBurst(20, 40, duration=5)], seed=7),
+    }
+    
+    for label, arrivals in patterns.items():
+        print(f"\n--- {label} ---")
+        result = await run_simulation_with_params(num_patients, 5, 10, diagnosis_pool, arrivals=arrivals)
+        result["pattern"] = label
+        results.append(result)
+    
+    print("\nLlegadas                       tiempo total  en sistema media / p99")
+    for result in results:
+        system = result["stage_stats"].summary('system')
+        print(f"{result['pattern']:<30} {result['total_time']:10.2f}s  {system['mean']:8.2f}s / {system['p99']:6.2f}s")
+    print("\nOcupación con la ráfaga:")
+    print_concurrency_timeline(results[-1]["timeline"])
+    
+    return results
+
+def _stage_stats_shard(seed, samples):
+    """Genera en un proceso aparte un StageStats con tiempos exponenciales"""
+    rng = random.Random(seed)
+    stats = StageStats()
+    for _ in range(samples):
+        stats.record('system', rng.expovariate(1 / 30))
+    return stats
+
+def test_streaming_stats():
+    """Compara las estadísticas en streaming con media móvil bajo lock y percentiles exactos"""
+    samples = 200_000
+    rng = random.Random(42)
+    values = [rng.expovariate(1 / 30) for _ in range(samples)]
+    
+    # Media móvil protegida por lock, como hacía process_discharge
+    lock = threading.Lock()
+    avg, count = 0.0, 0
+    start_time = time.perf_counter()
+    for value in values:
+        with lock:
+            count += 1
+            avg = (avg * (count - 1) + value) / count
+    lock_time = time.perf_counter() - start_time
+    
+    stats = StageStats()
+    start_time = time.perf_counter()
+    for value in values:
+        stats.record('system', value)
+    stream_time = time.perf_counter() - start_time
+    
+    exact = sorted(values)
+    summary = stats.summary('system')
+    print(f"Media móvil con lock: {samples / lock_time:,.0f} muestras/s (solo media)")
+    print(f"Streaming (Welford + histograma): {samples / stream_time:,.0f} muestras/s, "
+          f"{len(stats.stages['system'][1].buckets)} cubetas en memoria")
+    for q in (50, 90, 99):
+        error = abs(summary[f'p{q}'] - percentile(exact, q)) / percentile(exact, q)
+        print(f"  p{q}: {summary[f'p{q}']:.2f}s (exacto {percentile(exact, q):.2f}s, error {error:.2%})")
+    
+    # Fusión de shards calculados en otros procesos
+    with multiprocessing.Pool(4) as pool:
+        shards = pool.starmap(_stage_stats_shard, [(seed, samples // 4) for seed in range(4)])
+    merged = StageStats()
+    for shard in shards:
+        merged.merge(shard)
+    merged_summary = merged.summary('system')
+    print(f"Fusión de 4 procesos: {merged_summary['count']} muestras, media {merged_summary['mean']:.2f}s, "
+          f"p99 {merged_summary['p99']:.2f}s")
+    
+    return {"lock_rate": samples / lock_time, "stream_rate": samples / stream_time, "summary": summary}
+
+def test_event_logging():
+    """Compara el coste por evento de print frente al registro en cola (texto, JSON, muestreo, apagado)"""
+    events = 100_000
+    results = {}
+    
+    with open(os.devnull, "w") as devnull:
+        start_time = time.perf_counter()
+        for i in range(events):
+            print(f"Paciente {i} dado de alta. Tiempo total en sistema: {1.5:.2f}s", file=devnull)
+        results["print"] = time.perf_counter() - start_time
+        
+        configs = [
+            ("cola (texto)", dict(stream=devnull)),
+            ("cola (JSON lines)", dict(stream=devnull, json_lines=True)),
+            ("cola, muestreo 10%", dict(stream=devnull, sample_rate=0.1)),
+            ("desactivado", dict(enabled=False)),
+        ]
+        for label, config in configs:
+            configure_logging(**config)
+            start_time = time.perf_counter()
+            for i in range(events):
+                log_event(logging.INFO, 'patient_discharged',
+                          "Paciente {patient_id} dado de alta. Tiempo total en sistema: {time_in_system:.2f}s",
+                          patient_id=i, time_in_system=1.5)
+            results[label] = time.perf_counter() - start_time # Solo el coste en el hilo que registra
+            shutdown_logging()
+    configure_logging(enabled=False)
+    
+    for label, elapsed in results.items():
+        print(f"{label:<20} {elapsed / events * 1e6:6.2f}µs por evento en el camino crítico")
+    
+    return results
+
+def _register_patient_locked(patient, resources):
+    """Registro con la sección crítica anterior: prioridad y envío a diagnóstico dentro del lock"""
+    clock = get_clock()
+    processing_time = random.uniform(0.5, 1.5)
+    clock.sleep(processing_time)
+    resources.stats.record('registration', processing_time)
+    with resources.registration_lock:
+        resources.total_patients += 1
+        patient.priority = random.choice(PRIORITIES)
+        patient.set_status(PatientStatus.REGISTERED)
+        record = encode_diagnosis_request(patient)
+        resources.pending_diagnosis[patient.id] = patient
+        patient.set_status(PatientStatus.WAITING_DIAGNOSIS)
+        resources.diagnosis_queue.put(record, patient.priority.value)
+        log_event(logging.INFO, 'patient_registered', "Paciente {patient_id} registrado", patient_id=patient.id)
+
+async def benchmark_registration(num_patients, num_threads, time_scale, register=register_patient, mode='threads'):
+    """Mide el throughput de la etapa de registro aislada (pacientes por segundo real)"""
+    previous_clock = get_clock()
+    set_clock(SimulationClock(time_scale))
+    resources = HospitalResources()
+    resources.diagnosis_queue = PriorityDiagnosisQueue()
+    patients = [Patient(priority=Priority.MEDIUM, id=i, name=f"Paciente_{i}", symptoms=["Fiebre"])
+                for i in range(1, num_patients + 1)]
+    
+    start_time = time.perf_counter()
+    if mode == 'asyncio':
+        await asyncio.gather(*(register_patient_async(patient, resources) for patient in patients))
+    else:
+        with ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="BenchRegWorker") as executor:
+            for patient in patients:
+                executor.submit(register, patient, resources)
+    elapsed = time.perf_counter() - start_time
+    
+    assert resources.total_patients == num_patients
+    for _ in range(num_patients): # Vaciar la cola para que su hilo alimentador termine
+        resources.diagnosis_queue.get()
+    resources.diagnosis_queue.close()
+    set_clock(previous_clock)
+    return num_patients / elapsed
+
+async def test_registration_throughput():
+    """Throughput del registro según el número de hilos, con la sección crítica reducida y la anterior"""
+    results = []
+    
+    num_patients = 2000
+    time_scale = 1_000 # El registro simulado (0.5-1.5s) dura ~1ms real
+    thread_counts = [1, 5, 20, 50]
+    
+    print("Hilos   ideal        sección crítica reducida   envío dentro del lock")
+    for num_threads in thread_counts:
+        ideal = num_threads * time_scale # Un registro medio dura 1s simulado
+        reduced = await benchmark_registration(num_patients, num_threads, time_scale)
+        locked = await benchmark_registration(num_patients, num_threads, time_scale, _register_patient_locked)
+        results.append({"threads": num_threads, "reduced": reduced, "locked": locked})
+        print(f"{num_threads:>5} {ideal:8.0f}/s   {reduced:8.0f}/s ({reduced / ideal:4.0%})"
+              f"        {locked:8.0f}/s ({locked / ideal:4.0%})")
+    
+    return results
+
+async def test_registration_modes():
+    """Compara el registro en 5 hilos con el registro como corrutinas según el número de pacientes"""
+    results = []
+    
+    time_scale = 1_000 # El registro simulado (0.5-1.5s) dura ~1ms real
+    patient_counts = [10, 1_000, 100_000]
+    
+    print("Pacientes   hilos (5)        asyncio")
+    for count in patient_counts:
+        threads = await benchmark_registration(count, 5, time_scale)
+        coroutines = await benchmark_registration(count, 0, time_scale, mode='asyncio')
+        results.append({"patients": count, "threads": threads, "asyncio": coroutines})
+        print(f"{count:>9} {threads:10.0f}/s  {coroutines:10.0f}/s  (x{coroutines / threads:.1f})")
+    
+    return results
+
+async def measure_simulation_memory(num_patients, time_scale, max_patients_in_system=None):
+    """Pico de memoria (tracemalloc, proceso principal) de una simulación real con registro asyncio"""
+    previous_clock = get_clock()
+    set_clock(SimulationClock(time_scale))
+    with DiagnosisWorkerPool(num_workers=4) as pool:
+        resources = HospitalResources(num_doctors=50, num_beds=100, registration_mode='asyncio',
+                                      max_patients_in_system=max_patients_in_system)
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        await hospital_simulation(num_patients, resources, pool)
+        elapsed = time.perf_counter() - start_time
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    set_clock(previous_clock)
+    return {"patients": num_patients, "limit": max_patients_in_system, "peak_mb": peak / 1e6, "wall_time": elapsed,
+            "processed": resources.processed_patients}
+
+async def test_streaming_memory():
+    """Pico de memoria con todos los pacientes creados de golpe frente a una fuente bajo demanda con límite"""
+    results = []
+    
+    limit = 200
+    print("\n--- Simulación de eventos discretos ---")
+    for count, max_in_system in [(100_000, None), (100_000, limit), (1_000_000, limit)]:
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        result = run_discrete_event_simulation(count, 50, 100, num_diagnosis_workers=40, seed=42,
+                                               max_patients_in_system=max_in_system)
+        elapsed = time.perf_counter() - start_time
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append({"mode": "des", "patients": count, "limit": max_in_system, "peak_mb": peak / 1e6,
+                        "wall_time": elapsed, "processed": result["patients"]})
+    
+    print("\n--- Simulación real (escala x10000) ---")
+    for count, max_in_system in [(2_000, None), (2_000, limit), (10_000, limit)]:
+        result = await measure_simulation_memory(count, 10_000, max_in_system)
+        result["mode"] = "real"
+        results.append(result)
+    
+    print("\nModo  pacientes  límite en sistema  pico de memoria  tiempo real")
+    for result in results:
+        limit_label = result["limit"] if result["limit"] else "sin límite"
+        print(f"{result['mode']:<5} {result['patients']:>9}  {limit_label:>17}  {result['peak_mb']:12.1f}MB  {result['wall_time']:9.1f}s")
+    
+    return results
+
+def test_discrete_event_scaling():
+    """Prueba la simulación de eventos discretos con cargas que no caben en tiempo real"""
+    results = []
+    
+    patient_counts = [1_000, 10_000, 100_000]
+    
+    for count in patient_counts:
+        print(f"\n--- Simulación de eventos discretos con {count} pacientes ---")
+        start_time = time.perf_counter()
+        result = run_discrete_event_simulation(count, 50, 100, num_diagnosis_workers=40, seed=42)
+        result["wall_time"] = time.perf_counter() - start_time
+        results.append(result)
+        print(f"Tiempo simulado: {result['total_time']:.2f}s, Tiempo real: {result['wall_time']:.2f}s, Tiempo promedio por paciente: {result['avg_wait_time']:.2f}s")
+    
+    return results
+
+def benchmark_diagnosis_dispatch(num_patients, batch_size, time_scale, num_workers=2, transport='queue'):
+    """Mide el throughput de la etapa de diagnóstico aislada (pacientes por segundo real)"""
+    # Reloj propio con la escala del benchmark, compartido por el proceso principal y los workers
+    previous_clock = get_clock()
+    bench_clock = SimulationClock(time_scale)
+    set_clock(bench_clock)
+    diagnosis_queue = PriorityDiagnosisQueue(transport, batch_size)
+    result_queue = create_diagnosis_queue(transport, DIAGNOSIS_RESULT, batch_size)
+    workers = []
+    for i in range(num_workers):
+        p = multiprocessing.Process(
+            target=run_diagnosis_worker,
+            args=(diagnosis_queue, result_queue, bench_clock),
+            name=f"BenchDiagWorker-{i}"
+        )
+        p.start()
+        workers.append(p)
+
+    batcher = DiagnosisBatcher(diagnosis_queue, batch_size, max_linger=0.001) if batch_size > 1 else None
+    patients = [Patient(priority=Priority.MEDIUM, id=i, name=f"Paciente_{i}", symptoms=["Fiebre"])
+                for i in range(1, num_patients + 1)]
+
+    start_time = time.perf_counter()
+    for patient in patients:
+        record = encode_diagnosis_request(patient)
+        if batcher:
+            batcher.submit(record, patient.priority.value)
+        else:
+            diagnosis_queue.put(record, patient.priority.value)
+    if batcher:
+        batcher.close()
+
+    received = 0
+    while received < num_patients:
+        received += len(result_queue.get()) // DIAGNOSIS_RESULT.size
+    elapsed = time.perf_counter() - start_time
+
+    shutdown_diagnosis_workers(workers, diagnosis_queue)
+    diagnosis_queue.close()
+    result_queue.close()
+    set_clock(previous_clock)
+    return num_patients / elapsed
+
+def test_diagnosis_batching():
+    """Compara el envío individual frente a lotes para distintos tiempos de servicio"""
+    results = []
+    
+    num_patients = 1000
+    batch_sizes = [1, 4, 16, 64]
+    # Escalas temporales: el diagnóstico simulado (1-3s) pasa a durar ~2µs, ~200µs y ~2ms
+    time_scales = [1_000_000, 10_000, 1_000]
+    
+    for time_scale in time_scales:
+        service_time_ms = 2000 / time_scale
+        throughputs = {}
+        for batch_size in batch_sizes:
+            throughputs[batch_size] = benchmark_diagnosis_dispatch(num_patients, batch_size, time_scale)
+            results.append({"service_time_ms": service_time_ms, "batch_size": batch_size,
+                            "throughput": throughputs[batch_size]})
+        
+        print(f"\n--- Tiempo de servicio ~{service_time_ms:.3f}ms por paciente ---")
+        for batch_size, throughput in throughputs.items():
+            speedup = throughput / throughputs[1]
+            print(f"Lote {batch_size:>3}: {throughput:10.0f} pacientes/s (x{speedup:.2f} frente a envío individual)")
+        best = max(throughputs, key=throughputs.get)
+        if best == 1:
+            print("Con este tiempo de servicio el envío por lotes ya no compensa (punto de cruce superado)")
+    
+    return results
+
+def test_diagnosis_transport():
+    """Compara multiprocessing.Queue con el buffer circular en memoria compartida según el número de workers"""
+    results = []
+    
+    num_patients = 2000
+    time_scale = 1_000_000 # Diagnóstico casi instantáneo: domina el coste de transporte
+    worker_counts = [1, 2, 4, max(1, multiprocessing.cpu_count())]
+    
+    for num_workers in sorted(set(worker_counts)):
+        print(f"\n--- {num_workers} workers de diagnóstico ---")
+        for transport in ('queue', 'shm'):
+            throughput = benchmark_diagnosis_dispatch(num_patients, 1, time_scale, num_workers, transport)
+            results.append({"workers": num_workers, "transport": transport, "throughput": throughput})
+            print(f"Transporte {transport:<5}: {throughput:10.0f} pacientes/s")
+    
+    return results
+
+def test_ipc_wire_format():
+    """Compara bytes y tiempo de pickle por paciente: Patient completo frente a registros compactos"""
+    iterations = 10_000
+    patient = Patient(priority=Priority.HIGH, id=12345, name="Paciente_12345", symptoms=SYMPTOMS[:2],
+                      status=PatientStatus.WAITING_DIAGNOSIS)
+    diagnosed = Patient(priority=Priority.HIGH, id=12345, name="Paciente_12345", symptoms=SYMPTOMS[:2],
+                        status=PatientStatus.DIAGNOSED,
+                        diagnosis={'condition': 'Fractura', 'severity': 7, 'recommended_treatment': 'Cirugía',
+                                   'processing_time': 2.1, 'completed_at': get_clock().now()})
+    request = encode_diagnosis_request(patient)
+    result = DIAGNOSIS_RESULT.pack(12345, 1, 7, 1, 2.1, 0.4, get_clock().now())
+
+    def measure(label, obj, roundtrip=None):
+        payload = pickle.dumps(obj)
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            pickle.loads(pickle.dumps(obj))
+            if roundtrip:
+                roundtrip()
+        elapsed_us = (time.perf_counter() - start_time) / iterations * 1e6
+        print(f"{label:<32} {len(payload):>5} bytes/paciente, {elapsed_us:6.2f}µs serialización ida y vuelta")
+        return {"format": label, "bytes": len(payload), "pickle_us": elapsed_us}
+
+    results = [
+        measure("Petición: Patient completo", patient),
+        measure("Petición: registro compacto", request, lambda: encode_diagnosis_request(patient)),
+        measure("Resultado: Patient completo", diagnosed),
+        measure("Resultado: registro compacto", result,
+                lambda: merge_diagnosis_results(result, {12345: patient})),
+    ]
+    return results
+
 def visualize_results(patient_results, resource_results):
     """Visualiza los resultados de las pruebas de rendimiento"""
     plt.figure(figsize=(15, 10))
@@ -137,13 +837,82 @@ def visualize_results(patient_results, resource_results):
     print("Gráficos de rendimiento guardados en 'performance_results.png'")
 
 async def main():
-    print("Iniciando pruebas de rendimiento del sistema hospitalario...")
+    print(f"Iniciando pruebas de rendimiento del sistema hospitalario (escala temporal x{TIME_SCALE})...")
+    set_time_scale(TIME_SCALE)
+    configure_logging(enabled=False) # Sin registro de eventos por paciente durante las mediciones
+    
+    # Un único pool de diagnóstico para todas las simulaciones de escalabilidad
+    with DiagnosisWorkerPool() as diagnosis_pool:
+        diagnosis_pool.warm_up()
+        
+        print("\n=== PRUEBAS DE ESCALABILIDAD DE PACIENTES ===")
+        patient_results = await test_patient_scaling(diagnosis_pool)
+        
+        print("\n=== PRUEBAS DE ESCALABILIDAD DE RECURSOS ===")
+        resource_results = await test_resource_scaling(diagnosis_pool)
+        
+        print("\n=== PRUEBAS DE PRIORIDAD EN ASIGNACIÓN DE RECURSOS ===")
+        await test_resource_priority(diagnosis_pool)
+        
+        print("\n=== PRUEBAS DE ASIGNACIÓN ATÓMICA DE DOCTOR Y CAMA ===")
+        await test_allocation_modes(diagnosis_pool)
+        
+        print("\n=== PRUEBAS DE ASIGNACIÓN SEGÚN DIAGNÓSTICO ===")
+        await test_resource_matching(diagnosis_pool)
+        
+        print("\n=== PRUEBAS DE CONSUMIDORES DE ALTA ===")
+        await test_discharge_scaling(diagnosis_pool)
+        
+        print("\n=== PRUEBAS DE POLÍTICA DE LIBERACIÓN DE RECURSOS ===")
+        await test_release_policies(diagnosis_pool)
+        
+        print("\n=== PRUEBAS DE DESGLOSE DE LATENCIA POR ETAPA ===")
+        await test_stage_breakdown(diagnosis_pool)
+        
+        print("\n=== PRUEBAS DE REGISTRO EN PARALELO CON EL RESTO DEL FLUJO ===")
+        await test_registration_pipeline(diagnosis_pool)
+        
+        print("\n=== PRUEBAS DE CARGA OFRECIDA (LLEGADAS EN BUCLE ABIERTO) ===")
+        await test_offered_load()
+        
+        print("\n=== PRUEBAS DE PATRONES DE LLEGADA ===")
+        await test_arrival_patterns(diagnosis_pool)
+    
+    print("\n=== PRUEBAS DE POOL DE DIAGNÓSTICO PERSISTENTE ===")
+    await test_persistent_pool()
+    
+    print("\n=== PRUEBAS DE FORMATO COMPACTO DE IPC ===")
+    test_ipc_wire_format()
+    
+    print("\n=== PRUEBAS DE ENVÍO POR LOTES A DIAGNÓSTICO ===")
+    test_diagnosis_batching()
+    
+    print("\n=== PRUEBAS DE TRANSPORTE DE DIAGNÓSTICO ===")
+    test_diagnosis_transport()
+    
+    print("\n=== PRUEBAS DE PRIORIDAD EN DIAGNÓSTICO ===")
+    await test_diagnosis_priority()
+    
+    print("\n=== PRUEBAS DE AUTOESCALADO DE DIAGNÓSTICO ===")
+    await test_diagnosis_autoscaling()
+    
+    print("\n=== PRUEBAS DE ESTADÍSTICAS EN STREAMING ===")
+    test_streaming_stats()
+    
+    print("\n=== PRUEBAS DE REGISTRO DE EVENTOS ===")
+    test_event_logging()
+    
+    print("\n=== PRUEBAS DE THROUGHPUT DEL REGISTRO DE PACIENTES ===")
+    await test_registration_throughput()
+    
+    print("\n=== PRUEBAS DE REGISTRO CON ASYNCIO ===")
+    await test_registration_modes()
     
-    print("\n=== PRUEBAS DE ESCALABILIDAD DE PACIENTES ===")
-    patient_results = await test_patient_scaling()
+    print("\n=== PRUEBAS DE MEMORIA CON FUENTE DE PACIENTES BAJO DEMANDA ===")
+    await test_streaming_memory()
     
-    print("\n=== PRUEBAS DE ESCALABILIDAD DE RECURSOS ===")
-    resource_results = await test_resource_scaling()
+    print("\n=== PRUEBAS DE SIMULACIÓN DE EVENTOS DISCRETOS ===")
+    test_discrete_event_scaling()
     
     print("\n=== GENERANDO VISUALIZACIONES ===")
     visualize_results(patient_results, resource_results)